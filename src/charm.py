@@ -4,7 +4,12 @@
 #
 # Learn more at: https://juju.is/docs/sdk
 
+import hashlib
+import json
 import logging
+import time
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Sequence
 
 from ops.charm import CharmBase
 from ops.framework import StoredState
@@ -13,11 +18,22 @@ from ops.manifests import Collector, ManifestClientError
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
 from yaml import YAMLError
 
+import profiling
+import snapshot
+from listing import InvalidCursor, ListingStats, Timer, paginate, version_order
 from manifests import MultusManifests
-from net_attach_definitions import NetworkAttachDefinitions, ValidationError
+from net_attach_definitions import (
+    Incomplete,
+    NADIdentity,
+    NetworkAttachDefinitions,
+    Shard,
+    ValidationError,
+)
 
 log = logging.getLogger(__name__)
 
+PEERS = "multus-peers"
+
 
 class MultusCharm(CharmBase):
     """A Juju charm for Multus CNI"""
@@ -29,16 +45,27 @@ class MultusCharm(CharmBase):
         self.manifests = MultusManifests(self, self.config)
         self.collector = Collector(self.manifests)
         self.nad_manager = NetworkAttachDefinitions(self.manifests.client)
+        if budget := self.config.get("hook-time-budget"):
+            self.nad_manager.deadline = time.monotonic() + budget
         self.stored.set_default(
             nad_manifest="",  # Store previous NAD manifest
+            nad_stale=False,  # Store whether applied NADs now render differently
+            nad_shard="",  # Store units of the previous NAD shard assignment
+            nad_checkpoint={},  # Store progress of an incomplete NAD apply
+            release="",  # Store release and registry of the applied manifests
+            preflight_problems=[],  # Store problems found verifying a new release
+            snapshot="",  # Store the versioned reconcile snapshot
             blocked=False,  # Store Blocked Status
             deployed=False,
         )
 
         self.framework.observe(self.on.install, self._install_or_upgrade)
-        self.framework.observe(self.on.upgrade_charm, self._install_or_upgrade)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
         self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.remove, self._on_remove)
+        self.framework.observe(self.on.leader_elected, self._on_peers_changed)
+        self.framework.observe(self.on[PEERS].relation_changed, self._on_peers_changed)
+        self.framework.observe(self.on[PEERS].relation_departed, self._on_peers_changed)
 
         self.framework.observe(self.on.list_versions_action, self._list_versions)
         self.framework.observe(self.on.list_resources_action, self._list_resources)
@@ -47,9 +74,13 @@ class MultusCharm(CharmBase):
         self.framework.observe(
             self.on.scrub_net_attach_defs_action, self._scrub_net_attach_defs
         )
-        self.framework.observe(self.on.update_status, self._update_status)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.profile_hotspots_action, self._profile_hotspots)
+        self.framework.observe(self.on.multus_health_action, self._multus_health)
 
     def _scrub_net_attach_defs(self, event):
+        # an explicit scrub runs to completion rather than within a hook's budget
+        self.nad_manager.deadline = None
         try:
             self.nad_manager.scrub_resources()
             msg = "Successfully scrubbed resources from the cluster."
@@ -59,34 +90,209 @@ class MultusCharm(CharmBase):
             log.error(msg)
             event.fail(msg)
 
+    def _multus_health(self, event):
+        try:
+            health = self.manifests.health()
+        except ManifestClientError as e:
+            msg = "Failed to evaluate Multus health: " + " -> ".join(map(str, e.args))
+            log.error(msg)
+            event.fail(msg)
+            return
+        if health is None:
+            event.fail("The Multus DaemonSet isn't part of this release")
+            return
+        limit = event.params.get("limit", 20)
+        details = set(event.params.get("nodes", "").split())
+        nodes = health.unhealthy[:limit] if limit > 0 else health.unhealthy
+        listed = {n.node for n in nodes}
+        nodes += [
+            health.nodes[n] for n in sorted(details - listed) if n in health.nodes
+        ]
+        results = {
+            "summary": health.as_dict(),
+            "message": health.message() or "Ready",
+            "nodes": json.dumps([n._asdict() for n in nodes]),
+        }
+        if health.rollout:
+            results["rollout"] = health.rollout
+        event.set_results(results)
+
+    def _profile_hotspots(self, event):
+        top, hook = event.params.get("top", 10), event.params.get("hook", "")
+        found = profiling.profiles(hook)
+        if not found:
+            event.fail("No profiles found. Enable them with the profile-hooks config.")
+            return
+        event.set_results(
+            {
+                "profiles": len(found),
+                "latest": found[-1].stem,
+                "cpu": profiling.cpu_hotspots(found, top),
+                "memory": profiling.memory_hotspots(found[-1].with_suffix(".mem"), top),
+            }
+        )
+
     def _on_config_changed(self, event):
-        current_nads = self.stored.nad_manifest
+        profiling.set_enabled(self.config["profile-hooks"])
+        self._apply_net_attach_defs(event)
+        self._install_or_upgrade(event)
+
+    def _on_peers_changed(self, event):
+        self._apply_net_attach_defs(event)
+
+    def _nad_shard(self) -> Optional[Shard]:
+        """Determine which NADs this unit reconciles when sharding is enabled.
+
+        The leader assigns the shards from the units in the peer relation.
+        """
+        relation = self.model.get_relation(PEERS)
+        if not self.config["shard-net-attach-defs"] or not relation:
+            return None
+        if self.unit.is_leader():
+            units = sorted([self.unit.name] + [u.name for u in relation.units])
+            relation.data[self.app]["nad-shard-units"] = json.dumps(units)
+        units = json.loads(relation.data[self.app].get("nad-shard-units", "[]"))
+        return Shard(self.unit.name, tuple(units))
+
+    def _report_nad_shard(self, **status) -> None:
+        relation = self.model.get_relation(PEERS)
+        if self.nad_manager.shard and relation:
+            status["shard"] = self.stored.nad_shard
+            relation.data[self.unit]["nad-shard-status"] = json.dumps(status)
+
+    def _apply_net_attach_defs(self, event):
         na_definitions = self.config.get("network-attachment-definitions")
+        self.nad_manager.shard = shard = self._nad_shard()
+        shard_units = ",".join(shard.units) if shard else ""
 
-        if current_nads != na_definitions:
-            self.unit.status = WaitingStatus("Applying Network Attachment Definitions.")
-            try:
-                self.nad_manager.apply_manifests(na_definitions)
-                self.stored.nad_manifest = na_definitions
-                self.unit.status = ActiveStatus("Ready")
-                self.stored.blocked = False
-            except (YAMLError, ValidationError):
-                self.stored.blocked = True
-            except ManifestClientError as e:
-                log.error(f"Failed to apply net-attach-def manifests: {e}")
+        applied = (self.stored.nad_manifest, self.stored.nad_shard)
+        if not self.stored.nad_stale and applied == (na_definitions, shard_units):
+            return
 
-        self._install_or_upgrade(event)
+        target = hashlib.sha256(f"{shard_units}\n{na_definitions}".encode()).hexdigest()
+        checkpoint = self.stored.nad_checkpoint
+        if checkpoint.get("target") == target:
+            self.nad_manager.checkpoint = {
+                NADIdentity(*rsc) for rsc in checkpoint.get("applied", [])
+            }
+
+        self.unit.status = WaitingStatus("Applying Network Attachment Definitions.")
+        try:
+            self.nad_manager.apply_manifests(
+                na_definitions,
+                create_namespaces=self.config["create-net-attach-def-namespaces"],
+                reject_ipam_conflicts=self.config["reject-ipam-conflicts"],
+            )
+            self.stored.nad_manifest = na_definitions
+            self.stored.nad_shard = shard_units
+            self.stored.nad_checkpoint = {}
+            self.stored.nad_stale = False
+            self._save_nad_snapshot()
+            self.unit.status = ActiveStatus("Ready")
+            self.stored.blocked = False
+            self._report_nad_shard(applied=len(self.nad_manager.resources))
+        except (YAMLError, ValidationError):
+            self.stored.blocked = True
+        except Incomplete as e:
+            log.info(f"Continuing net-attach-defs in the next hook: {e}")
+            self.stored.nad_checkpoint = {
+                "target": target,
+                "applied": [list(rsc) for rsc in e.done],
+            }
+            self.unit.status = WaitingStatus(
+                f"Applied {len(e.done)} Network Attachment Definitions, "
+                f"{len(e.remaining)} remaining."
+            )
+            event.defer()
+        except ManifestClientError as e:
+            log.error(f"Failed to apply net-attach-def manifests: {e}")
+            self._report_nad_shard(error=str(e))
+
+    def _pending_nad_shards(self) -> List[str]:
+        """Units which haven't reconciled their current NAD shard."""
+        relation = self.model.get_relation(PEERS)
+        shard = self.nad_manager.shard
+        if not shard or not relation:
+            return []
+        current = ",".join(shard.units)
+        pending = []
+        for unit in [self.unit, *relation.units]:
+            status = json.loads(relation.data[unit].get("nad-shard-status", "{}"))
+            if status.get("error") or status.get("shard") != current:
+                pending.append(unit.name)
+        return sorted(pending)
 
     def _list_versions(self, event):
-        self.collector.list_versions(event)
+        with Timer() as timer:
+            releases = self.manifests.releases
+
+        def text(page: List[str]) -> Dict[str, str]:
+            return {f"{self.manifests.name}-versions": "\n".join(page)}
+
+        self._set_listing(
+            event, releases, str, 0, timer, text, order=version_order, reverse=True
+        )
 
     def _list_resources(self, event):
-        manifests = self.manifests.name
-        resources = event.params.get("resources", "")
-        return self.collector.list_resources(
-            event, manifests=manifests, resources=resources
+        params = event.params
+        kinds = set(params.get("resources", "").lower().split())
+        try:
+            with Timer() as timer:
+                entries, api_calls = self.manifests.list_resources(
+                    kinds, params.get("namespace") or None, params.get("name") or None
+                )
+        except ManifestClientError as e:
+            msg = "Failed to list resources: " + " -> ".join(map(str, e.args))
+            log.error(msg)
+            event.fail(msg)
+            return
+
+        def text(page: List[Dict[str, str]]) -> Dict[str, str]:
+            by_state: Dict[str, List[str]] = {}
+            for entry in page:
+                key = f"{self.manifests.name}-{entry['state']}"
+                by_state.setdefault(key, []).append(entry["resource"])
+            return {key: "\n".join(value) for key, value in by_state.items()}
+
+        self._set_listing(
+            event, entries, itemgetter("resource"), api_calls, timer, text
         )
 
+    def _set_listing(
+        self,
+        event,
+        items: Sequence,
+        key: Callable,
+        api_calls: int,
+        timer: Timer,
+        text: Callable[[List], Dict[str, str]],
+        **ordering,
+    ) -> None:
+        """Set one page of a listing and its stats as the action results.
+
+        @param ordering: how the items are sorted, as accepted by paginate
+        """
+        try:
+            page, cursor = paginate(
+                items,
+                key,
+                event.params.get("limit", 0),
+                event.params.get("cursor", ""),
+                **ordering,
+            )
+        except InvalidCursor as e:
+            event.fail(str(e))
+            return
+        if event.params.get("format") == "json":
+            results = {"items": json.dumps(page)}
+        else:
+            results = text(page)
+        stats = ListingStats(timer.elapsed, api_calls, len(items), len(page))
+        results["stats"] = stats.as_dict()
+        if cursor:
+            results["cursor"] = cursor
+        event.set_results(results)
+
     def _scrub_resources(self, event):
         manifests = self.manifests.name
         resources = event.params.get("resources", "")
@@ -108,19 +314,55 @@ class MultusCharm(CharmBase):
         else:
             self.stored.deployed = True
 
+    def _on_update_status(self, event):
+        self.nad_manager.shard = shard = self._nad_shard()
+        if shard:
+            # only heal a shard once its assignment has been applied
+            heal = self.stored.nad_shard == ",".join(shard.units)
+        else:
+            heal = self.unit.is_leader() and self.stored.deployed
+        # an incomplete apply is resumed by its deferred hook, which healing
+        # towards the previous manifest would undo
+        if heal and not self.stored.blocked and not self.stored.nad_checkpoint:
+            try:
+                self.nad_manager.heal_drift(self.stored.nad_manifest)
+            except Incomplete as e:
+                log.info(f"Continuing to heal net-attach-defs in the next hook: {e}")
+            except ManifestClientError as e:
+                log.error(f"Failed to heal net-attach-def drift: {e}")
+            else:
+                self._save_nad_snapshot()
+        self._update_status(event)
+
     def _update_status(self, _):
         if not self.stored.deployed:
             return
 
-        unready = self.collector.unready
         blocked = self.stored.blocked
+        pending_shards = self._pending_nad_shards()
+        try:
+            health = self.manifests.health()
+        except ManifestClientError as e:
+            log.error(f"Failed to evaluate Multus health: {e}")
+            self.unit.status = WaitingStatus("Waiting for kube-apiserver")
+            return
 
         if blocked:
             self.unit.status = BlockedStatus(
                 "Invalid NAD manifests. Check the logs for more information."
             )
-        elif unready:
-            self.unit.status = WaitingStatus(", ".join(unready))
+        elif problems := self.stored.preflight_problems:
+            self.unit.status = BlockedStatus(
+                f"Preflight failed: {problems[0]}. Check the logs."
+            )
+        elif health and health.rollout:
+            self.unit.status = WaitingStatus(health.rollout)
+        elif pending_shards:
+            self.unit.status = WaitingStatus(
+                f"Pending NAD shards: {', '.join(pending_shards)}"
+            )
+        elif health and health.message():
+            self.unit.status = WaitingStatus(health.message())
         else:
             self.unit.set_workload_version(self.collector.short_version)
             self.unit.status = ActiveStatus("Ready")
@@ -130,17 +372,89 @@ class MultusCharm(CharmBase):
         if not self.unit.is_leader():
             self.unit.status = ActiveStatus("Ready")
             return
-        log.info("Applying Multus manifests")
+        release = f"{self.manifests.current_release}@{self.config['image-registry']}"
+        state = self._snapshot()
+        fingerprint = self.manifests.fingerprint()
+        applied = state["manifests"]["fingerprint"] if self.stored.deployed else None
         try:
-            self.manifests.apply_manifests()
+            if release != self.stored.release and self.config["preflight-checks"]:
+                self.unit.status = MaintenanceStatus("Verifying Multus release")
+                if problems := self.manifests.preflight():
+                    log.error(f"Preflight checks failed: {problems}")
+                    self.stored.preflight_problems = problems
+                    self.unit.status = BlockedStatus(
+                        f"Preflight failed: {problems[0]}. Check the logs."
+                    )
+                    return
+            self.stored.preflight_problems = []
+            # applying every resource prunes the fields no longer rendered,
+            # so only an unchanged or unknown fingerprint is checked for drift
+            if applied not in ("", fingerprint):
+                log.info("Applying Multus manifests")
+                self.manifests.apply_manifests()
+            elif not (drifted := self.manifests.drifted()):
+                log.info("Multus manifests are unchanged since they were applied")
+            elif not applied:
+                log.info("Applying Multus manifests of an unknown earlier revision")
+                self.manifests.apply_manifests()
+            else:
+                log.info("Re-applying Multus resources changed in the cluster")
+                self.manifests.apply_resources(*drifted)
         except ManifestClientError:
             self.unit.status = WaitingStatus("Waiting for kube-apiserver")
             event.defer()
             return
+        state["manifests"] = {"release": release, "fingerprint": fingerprint}
+        self.stored.snapshot = snapshot.dump(state)
+        self.stored.release = release
         self.stored.deployed = True
         self._update_status(event)
 
+    def _snapshot(self) -> Dict:
+        return snapshot.load(self.stored.snapshot, {"release": self.stored.release})
+
+    def _save_nad_snapshot(self) -> None:
+        """Record the NADs rendered by the reconciled manifests in the snapshot.
+
+        NADs skipped for unavailable namespaces are recorded too, as the
+        digests compared on upgrade are rendered without the cluster.
+        """
+        state = self._snapshot()
+        state["nads"] = {
+            "digests": {
+                f"{rsc.namespace}/{rsc.name}": rsc.digest
+                for rsc in self.nad_manager.expected
+            },
+            "resourceVersion": self.nad_manager.resource_version,
+        }
+        self.stored.snapshot = snapshot.dump(state)
+
+    def _on_upgrade_charm(self, event):
+        """Keep what the previous charm revision reconciled, unless it changed.
+
+        The snapshot is migrated to this revision's format. NADs rendered
+        differently by this revision are marked stale, so the next
+        config-changed reconciles them; otherwise they aren't even listed.
+        """
+        state = self._snapshot()
+        self.stored.snapshot = snapshot.dump(state)
+        manifest = self.stored.nad_manifest
+        if manifest:
+            self.nad_manager.shard = self._nad_shard()
+            try:
+                digests = self.nad_manager.digests(manifest)
+            except ManifestClientError as e:
+                log.error(f"Failed to render net-attach-defs: {e}")
+                digests = None
+            if digests is None or digests != state["nads"]["digests"]:
+                log.info("Net-attach-defs render differently, reconciling them")
+                self.stored.nad_stale = True
+        self._install_or_upgrade(event)
+
     def _on_remove(self, event):
+        # remove can't be deferred, so the teardown runs to completion
+        # rather than within the hook time budget
+        self.nad_manager.deadline = None
         log.info("Removing Network Attachment Definitions")
         try:
             self.nad_manager.remove_resources()
@@ -150,11 +464,13 @@ class MultusCharm(CharmBase):
             )
         except ManifestClientError as e:
             log.error(f"Failed to remove net-attach-defs from the cluster: {e}")
-            self.unit.status = WaitingStatus("Waiting for kube-apiserver")
-            event.defer()
+            self.unit.status = BlockedStatus(
+                "Failed to remove Multus resources. Check the logs."
+            )
             return
         self.unit.status = MaintenanceStatus("Shutting down")
 
 
-if __name__ == "__main__":
-    main(MultusCharm)  # pragma: no cover
+if __name__ == "__main__":  # pragma: no cover
+    with profiling.profiled():
+        main(MultusCharm)
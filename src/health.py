@@ -0,0 +1,170 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for summarizing the health of the Multus DaemonSet per node"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from httpx import HTTPError
+from lightkube import ApiError, Client
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import Pod
+from ops.manifests import ManifestClientError
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500  # pods per list request
+UNSCHEDULED = "<unscheduled>"
+# set by the DaemonSet controller to the pod-template-generation of new pods
+TEMPLATE_GENERATION = "deprecated.daemonset.template.generation"
+
+
+class NodeHealth(NamedTuple):
+    """State of the Multus pod running on one node."""
+
+    node: str
+    pod: str
+    ready: bool
+    restarts: int
+    reason: str
+    outdated: bool
+
+    @classmethod
+    def from_pod(cls, pod: Pod, generation: Optional[str]) -> "NodeHealth":
+        status = pod.status
+        containers = (status and status.containerStatuses) or []
+        ready = bool(containers) and all(c.ready for c in containers)
+        reason = (status and status.reason) or ""
+        for container in containers:
+            state = container.state
+            if state and state.waiting and state.waiting.reason:
+                reason = state.waiting.reason
+            elif state and state.terminated and state.terminated.reason:
+                reason = state.terminated.reason
+        if not ready and not reason:
+            reason = (status and status.phase) or "NotReady"
+        labels = pod.metadata.labels or {}
+        template = labels.get("pod-template-generation")
+        return cls(
+            node=(pod.spec and pod.spec.nodeName) or UNSCHEDULED,
+            pod=pod.metadata.name,
+            ready=ready,
+            restarts=sum(c.restartCount or 0 for c in containers),
+            reason="" if ready else reason,
+            outdated=generation is not None and template != generation,
+        )
+
+    def rank(self):
+        """Order pods of the same node, the one that counts ranking highest."""
+        return self.ready, not self.outdated
+
+
+class HealthSummary(NamedTuple):
+    """Multus health across every node of the DaemonSet."""
+
+    desired: int
+    nodes: Mapping[str, NodeHealth]
+    rollout: Optional[str] = None
+
+    @property
+    def unhealthy(self) -> List[NodeHealth]:
+        return sorted(
+            (n for n in self.nodes.values() if not n.ready), key=lambda n: n.node
+        )
+
+    @property
+    def missing(self) -> int:
+        """Nodes the DaemonSet should run on without any Multus pod."""
+        return max(self.desired - len(self.nodes), 0)
+
+    @property
+    def restarts(self) -> int:
+        return sum(n.restarts for n in self.nodes.values())
+
+    def message(self, limit: int = 3) -> str:
+        """A compact status message, empty when every node is healthy."""
+        unhealthy = self.unhealthy
+        parts = []
+        if unhealthy:
+            shown = ", ".join(f"{n.node} ({n.reason})" for n in unhealthy[:limit])
+            if len(unhealthy) > limit:
+                shown += f" +{len(unhealthy) - limit} more"
+            parts.append(
+                f"Multus unready on {len(unhealthy)}/{self.desired} nodes: {shown}"
+            )
+        if self.missing:
+            parts.append(f"{self.missing} nodes without a Multus pod")
+        return "; ".join(parts)
+
+    def as_dict(self) -> Dict:
+        return {
+            "desired": self.desired,
+            "ready": len(self.nodes) - len(self.unhealthy),
+            "unready": len(self.unhealthy),
+            "missing": self.missing,
+            "outdated": sum(n.outdated for n in self.nodes.values()),
+            "restarts": self.restarts,
+        }
+
+
+def rollout_message(daemonset: DaemonSet) -> Optional[str]:
+    """Summarize an in-progress rollout from the DaemonSet status counters."""
+    status = daemonset.status
+    if not status:
+        return None
+    desired = status.desiredNumberScheduled
+    updated = status.updatedNumberScheduled or 0
+    available = status.numberAvailable or 0
+    generation = daemonset.metadata.generation or 0
+    observed = status.observedGeneration or 0
+    if observed >= generation and updated >= desired and available >= desired:
+        return None
+    return (
+        f"Rolling out {daemonset.metadata.name}: {updated}/{desired} nodes updated, "
+        f"{status.numberUnavailable or 0} unavailable"
+    )
+
+
+def template_generation(daemonset: DaemonSet) -> Optional[str]:
+    """The pod-template-generation label of the DaemonSet's current pods."""
+    annotations = daemonset.metadata.annotations or {}
+    return annotations.get(TEMPLATE_GENERATION)
+
+
+def evaluate(
+    client: Client, name: str, namespace: str, selector: Mapping[str, str]
+) -> HealthSummary:
+    """Build the per-node health of a DaemonSet.
+
+    The DaemonSet is read while the first page of its pods is listed, then
+    the pods are folded into a per-node index page by page as they arrive,
+    so the cost grows linearly with the number of nodes.
+
+    @param client:    lightkube client
+    @param name:      name of the DaemonSet
+    @param namespace: namespace of the DaemonSet
+    @param selector:  labels selecting the DaemonSet's pods
+    """
+    nodes: Dict[str, NodeHealth] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            request = pool.submit(client.get, DaemonSet, name, namespace=namespace)
+            pods = iter(
+                client.list(
+                    Pod, namespace=namespace, labels=selector, chunk_size=CHUNK_SIZE
+                )
+            )
+            first = next(pods, None)
+            daemonset = request.result()
+        generation = template_generation(daemonset)
+        for pod in chain([first] if first else [], pods):
+            health = NodeHealth.from_pod(pod, generation)
+            current = nodes.get(health.node)
+            if current is None or health.rank() > current.rank():
+                nodes[health.node] = health
+    except (ApiError, HTTPError) as e:
+        raise ManifestClientError(f"Failed to read the health of {name}", e) from e
+
+    desired = (daemonset.status and daemonset.status.desiredNumberScheduled) or 0
+    return HealthSummary(desired, nodes, rollout_message(daemonset))
@@ -0,0 +1,137 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for detecting IPAM conflicts between Network Attachment Definitions"""
+import heapq
+import ipaddress
+import json
+import logging
+from typing import Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__file__)
+
+# keys naming the same setting in host-local and whereabouts ipam
+SUBNET_KEYS = ("subnet", "range")
+START_KEYS = ("rangeStart", "range_start")
+END_KEYS = ("rangeEnd", "range_end")
+
+
+class Interval(NamedTuple):
+    """Allocatable addresses of one ipam range."""
+
+    version: int
+    start: int
+    end: int
+    owner: str
+
+    def __str__(self) -> str:
+        first, last = (ipaddress.ip_address(_) for _ in (self.start, self.end))
+        return f"{self.owner} ({first}-{last})"
+
+
+class Gateway(NamedTuple):
+    """Gateway address of one ipam range."""
+
+    version: int
+    address: int
+    owner: str
+
+
+def _first(rng: Mapping, keys: Tuple[str, ...]) -> Optional[str]:
+    return next((rng[k] for k in keys if rng.get(k)), None)
+
+
+def _ipam_blocks(config: Mapping) -> Iterator[Mapping]:
+    """Yield the ipam section of a plugin config or of each chained plugin."""
+    for plugin in [config, *(config.get("plugins") or [])]:
+        if isinstance(plugin, Mapping) and isinstance(plugin.get("ipam"), Mapping):
+            yield plugin["ipam"]
+
+
+def _ranges(ipam: Mapping) -> Iterator[Mapping]:
+    """Yield every range of a host-local or whereabouts ipam section."""
+    if _first(ipam, SUBNET_KEYS):
+        yield ipam
+    for range_set in ipam.get("ranges") or []:
+        yield from (rng for rng in range_set if isinstance(rng, Mapping))
+    yield from (rng for rng in ipam.get("ipRanges") or [] if isinstance(rng, Mapping))
+
+
+def _parse_range(rng: Mapping, owner: str) -> Tuple[Interval, Optional[Gateway]]:
+    subnet = _first(rng, SUBNET_KEYS)
+    start, end = _first(rng, START_KEYS), _first(rng, END_KEYS)
+    address, _, prefix = subnet.partition("/")
+    if "-" in address:
+        # whereabouts accepts an explicit "start-end/prefix" range
+        start, end = start or address.split("-")[0], end or address.split("-")[1]
+        subnet = f"{start}/{prefix}"
+    network = ipaddress.ip_network(subnet, strict=False)
+    first = ipaddress.ip_address(start) if start else network.network_address
+    last = ipaddress.ip_address(end) if end else network.broadcast_address
+    interval = Interval(network.version, int(first), int(last), owner)
+
+    gateway = None
+    if rng.get("gateway"):
+        gw = ipaddress.ip_address(rng["gateway"])
+        gateway = Gateway(gw.version, int(gw), owner)
+    return interval, gateway
+
+
+def ipam_ranges(owner: str, config: str) -> Tuple[List[Interval], List[Gateway]]:
+    """Extract the allocatable ranges and gateways of a NAD's spec.config.
+
+    @param owner:  name identifying the NAD in conflict reports
+    @param config: the JSON text of spec.config
+    """
+    intervals: List[Interval] = []
+    gateways: List[Gateway] = []
+    try:
+        parsed = json.loads(config)
+    except (TypeError, ValueError):
+        return intervals, gateways
+    if not isinstance(parsed, Mapping):
+        return intervals, gateways
+    for ipam in _ipam_blocks(parsed):
+        for rng in _ranges(ipam):
+            try:
+                interval, gateway = _parse_range(rng, owner)
+            except (TypeError, ValueError) as e:
+                log.warning(f"Ignoring unparsable ipam range of {owner}: {e}")
+                continue
+            intervals.append(interval)
+            if gateway:
+                gateways.append(gateway)
+    return intervals, gateways
+
+
+def find_conflicts(
+    intervals: Iterable[Interval], gateways: Iterable[Gateway] = ()
+) -> List[str]:
+    """Find overlapping ranges and gateways allocatable by another NAD.
+
+    Ranges and gateways are swept in address order while a heap keeps the
+    ranges which are still open, so the cost is O(n log n) plus the number
+    of conflicts rather than a pairwise comparison.
+    """
+    # ranges sort before gateways at the same address
+    events = [(i.version, i.start, 0, i) for i in intervals]
+    events += [(g.version, g.address, 1, g) for g in gateways]
+    events.sort()
+    conflicts = []
+    active: List[Tuple[int, Interval]] = []
+    version = None
+    for event_version, address, kind, item in events:
+        if event_version != version:
+            version, active = event_version, []
+        while active and active[0][0] < address:
+            heapq.heappop(active)
+        others = [i for _, i in active if i.owner != item.owner]
+        if kind == 0:
+            conflicts += [f"{item} overlaps {other}" for other in others]
+            heapq.heappush(active, (item.end, item))
+        else:
+            gateway = ipaddress.ip_address(address)
+            conflicts += [
+                f"gateway {gateway} of {item.owner} is allocatable by {other}"
+                for other in others
+            ]
+    return conflicts
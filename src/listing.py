@@ -0,0 +1,100 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for paginating the listings returned by actions"""
+import base64
+import binascii
+import re
+import time
+from bisect import bisect_left
+from typing import Any, Callable, List, NamedTuple, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+_VERSION_SPLIT = re.compile(r"(\d+)").split
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor isn't one returned with a listing."""
+
+
+class ListingStats(NamedTuple):
+    """Cost of producing one listing."""
+
+    elapsed: float
+    api_calls: int
+    total: int
+    returned: int
+
+    def as_dict(self):
+        return {
+            "elapsed-ms": round(self.elapsed * 1000, 1),
+            "api-calls": self.api_calls,
+            "total": self.total,
+            "returned": self.returned,
+        }
+
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor '{cursor}'") from e
+
+
+def version_order(version: str) -> List:
+    """Sort key of a release, ordering it numerically as ops.manifests does."""
+    return [int(part) if part.isdigit() else part for part in _VERSION_SPLIT(version)]
+
+
+def paginate(
+    items: Sequence[T],
+    key: Callable[[T], str],
+    limit: int = 0,
+    cursor: str = "",
+    order: Callable[[str], Any] = str,
+    reverse: bool = False,
+) -> Tuple[List[T], str]:
+    """Return one page of items and the cursor to the next page.
+
+    The cursor names the last item returned rather than its position. As
+    the items are sorted, a page picks up where that item sorts even if it
+    or earlier items come and go between calls.
+
+    @param items:   the whole listing, sorted by the order of their keys
+    @param key:     unique key of an item
+    @param limit:   maximum number of items in the page, 0 for all
+    @param cursor:  cursor returned with the previous page
+    @param order:   sort key applied to the key of an item
+    @param reverse: whether the items are sorted in descending order
+    """
+    start = 0
+    if cursor:
+        last = order(decode_cursor(cursor))
+
+        def after(index: int) -> bool:
+            rank = order(key(items[index]))
+            return rank < last if reverse else rank > last
+
+        try:
+            start = bisect_left(range(len(items)), True, key=after)
+        except TypeError as e:
+            raise InvalidCursor(f"Cursor '{cursor}' doesn't match the listing") from e
+    end = start + limit if limit > 0 else len(items)
+    page = list(items[start:end])
+    next_cursor = encode_cursor(key(page[-1])) if page and end < len(items) else ""
+    return page, next_cursor
+
+
+class Timer:
+    """Measure the time taken by a listing."""
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.start
@@ -1,11 +1,195 @@
-from typing import Dict
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AbstractSet, Dict, Iterator, List, Optional, Tuple, Union
 
-from ops.manifests import ConfigRegistry, ManifestLabel, Manifests
+from httpx import HTTPError
+from lightkube.core.exceptions import ApiError
+from lightkube.models.apps_v1 import DaemonSetUpdateStrategy, RollingUpdateDaemonSet
+from ops.manifests import (
+    ConfigRegistry,
+    HashableResource,
+    ManifestClientError,
+    ManifestLabel,
+    Manifests,
+    Patch,
+)
+from ops.manifests.literals import APP_LABEL, MANIFEST_LABEL
+
+from health import HealthSummary, evaluate
+from preflight import check_images
+
+log = logging.getLogger(__name__)
+
+# kinds removed before and after every other resource during teardown
+TEARDOWN_FIRST = ("DaemonSet",)
+TEARDOWN_LAST = ("CustomResourceDefinition",)
+
+
+def _contains(installed, rendered) -> bool:
+    """Whether every rendered field has the same value in the installed object.
+
+    Fields only present in the installed object, such as server defaults
+    and status, are ignored.
+    """
+    if isinstance(rendered, dict):
+        return isinstance(installed, dict) and all(
+            _contains(installed.get(k), v) for k, v in rendered.items()
+        )
+    if isinstance(rendered, list):
+        if not isinstance(installed, list) or len(installed) != len(rendered):
+            return False
+        return all(map(_contains, installed, rendered))
+    return installed == rendered
+
+
+def _int_or_percent(value: str) -> Union[int, str]:
+    """Convert a config value into a kubernetes IntOrString.
+
+    Accepts an absolute number ("1") or a percentage ("10%").
+    """
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    if value.endswith("%") and value[:-1].isdigit():
+        return value
+    raise ValueError(f"'{value}' is neither a number nor a percentage")
+
+
+class UpdateStrategy(Patch):
+    """Applies the rolling update limits from charm config to the DaemonSet."""
+
+    FIELDS = {
+        "daemonset-max-unavailable": "maxUnavailable",
+        "daemonset-max-surge": "maxSurge",
+    }
+
+    def __call__(self, obj):
+        """Sets updateStrategy.rollingUpdate on the DaemonSet."""
+        if obj.kind != "DaemonSet":
+            return
+
+        rolling_update = {}
+        for key, field in self.FIELDS.items():
+            value = self.manifests.config.get(key)
+            if value is None:
+                continue
+            try:
+                rolling_update[field] = _int_or_percent(value)
+            except ValueError as e:
+                log.error(f"Ignoring invalid {key}: {e}")
+                return
+
+        if not rolling_update:
+            return
+        log.info(f"Applying rolling update {rolling_update} to {obj.metadata.name}")
+        obj.spec.updateStrategy = DaemonSetUpdateStrategy(
+            type="RollingUpdate",
+            rollingUpdate=RollingUpdateDaemonSet(**rolling_update),
+        )
+
+
+class DaemonConfig(Patch):
+    """Renders the Multus daemon settings from charm config.
+
+    In "auto" mode the entrypoint generates the Multus config from the
+    primary CNI's, so settings are passed as entrypoint arguments. In
+    "configmap" mode the entrypoint installs cni-conf.json from the
+    multus-cni-config ConfigMap, so settings are written into it instead,
+    along with the delegates replacing the upstream flannel one.
+    """
+
+    CONF_FILE = "/tmp/multus-conf/70-multus.conf"
+    CONF_MODES = ("auto", "configmap")
+    LOG_LEVELS = ("debug", "verbose", "error", "panic")
+    # charm config key -> (entrypoint argument, cni-conf.json key)
+    SETTINGS = {
+        "multus-log-level": ("--multus-log-level", "logLevel"),
+        "multus-log-file": ("--multus-log-file", "logFile"),
+        "multus-readiness-indicator-file": (
+            "--readiness-indicator-file",
+            "readinessindicatorfile",
+        ),
+    }
+
+    def _settings(self) -> Dict[str, str]:
+        config = self.manifests.config
+        settings = {k: config[k] for k in self.SETTINGS if config.get(k) is not None}
+        level = settings.get("multus-log-level")
+        if level is not None and level not in self.LOG_LEVELS:
+            log.error(f"Ignoring invalid multus-log-level '{level}'")
+            del settings["multus-log-level"]
+        return settings
+
+    def _conf_mode(self) -> str:
+        mode = self.manifests.config.get("multus-conf-mode") or "auto"
+        if mode not in self.CONF_MODES:
+            log.error(f"Ignoring invalid multus-conf-mode '{mode}'")
+            return "auto"
+        return mode
+
+    def __call__(self, obj):
+        """Sets the daemon's arguments or the contents of its ConfigMap."""
+        if obj.kind == "ConfigMap" and obj.metadata.name == "multus-cni-config":
+            self._patch_conf(obj)
+        elif obj.kind == "DaemonSet":
+            self._patch_args(obj)
+
+    def _delegates(self) -> Optional[List[Dict]]:
+        delegates = self.manifests.config.get("multus-delegates")
+        if not delegates:
+            return None
+        try:
+            parsed = json.loads(delegates)
+        except ValueError as e:
+            log.error(f"Ignoring invalid multus-delegates: {e}")
+            return None
+        if not isinstance(parsed, list) or not all(isinstance(d, dict) for d in parsed):
+            log.error("Ignoring multus-delegates, which isn't a list of CNI configs")
+            return None
+        return parsed
+
+    def _patch_conf(self, obj):
+        if self._conf_mode() != "configmap":
+            return
+        conf = json.loads(obj.data["cni-conf.json"])
+        for key, value in self._settings().items():
+            conf[self.SETTINGS[key][1]] = value
+        if delegates := self._delegates():
+            conf["delegates"] = delegates
+        obj.data["cni-conf.json"] = json.dumps(conf, indent=2)
+
+    def _patch_args(self, obj):
+        container = next(
+            (c for c in obj.spec.template.spec.containers if c.name == "kube-multus"),
+            None,
+        )
+        if container is None:
+            return
+        managed = ["--multus-conf-file"] + [a for a, _ in self.SETTINGS.values()]
+        args = [a for a in container.args or [] if a.split("=")[0] not in managed]
+
+        if self._conf_mode() == "configmap":
+            args.insert(0, f"--multus-conf-file={self.CONF_FILE}")
+        else:
+            args.insert(0, "--multus-conf-file=auto")
+            args += [
+                f"{self.SETTINGS[key][0]}={value}"
+                for key, value in self._settings().items()
+            ]
+        log.info(f"Setting {obj.metadata.name} arguments to {args}")
+        container.args = args
 
 
 class MultusManifests(Manifests):
     def __init__(self, charm, charm_config):
-        manipulations = [ManifestLabel(self), ConfigRegistry(self)]
+        manipulations = [
+            ManifestLabel(self),
+            ConfigRegistry(self),
+            UpdateStrategy(self),
+            DaemonConfig(self),
+        ]
 
         super().__init__("multus", charm.model, "upstream/multus", manipulations)
         self.charm_config = charm_config
@@ -21,3 +205,179 @@ class MultusManifests(Manifests):
 
         config["release"] = config.pop("release", None)
         return config
+
+    def fingerprint(self) -> str:
+        """Digest of every resource rendered from the current config."""
+        digest = hashlib.sha256()
+        for rsc in sorted(self.resources, key=str):
+            digest.update(json.dumps(rsc.resource.to_dict(), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def drifted(self) -> List[HashableResource]:
+        """Rendered resources which are missing or differ in the cluster.
+
+        Each resource is read once, so a release that is already installed
+        as rendered is confirmed without writing anything.
+        """
+        drifted = []
+        for rsc in sorted(self.resources, key=str):
+            try:
+                installed = self.client.get(
+                    type(rsc.resource), rsc.name, namespace=rsc.namespace
+                )
+            except ApiError as e:
+                if e.status.code != 404:
+                    raise ManifestClientError(f"Failed to get {rsc}", e) from e
+                drifted.append(rsc)
+                continue
+            except HTTPError as e:
+                raise ManifestClientError(f"Failed to get {rsc}", e) from e
+            if not _contains(installed.to_dict(), rsc.resource.to_dict()):
+                drifted.append(rsc)
+        return drifted
+
+    def _daemonset(self) -> Optional[HashableResource]:
+        return next((r for r in self.resources if r.kind == "DaemonSet"), None)
+
+    def health(self) -> Optional[HealthSummary]:
+        """Per-node health of the Multus DaemonSet, None if not rendered."""
+        daemonset = self._daemonset()
+        if daemonset is None:
+            return None
+        selector = daemonset.resource.spec.selector.matchLabels
+        return evaluate(self.client, daemonset.name, daemonset.namespace, selector)
+
+    def list_resources(
+        self,
+        kinds: AbstractSet[str] = frozenset(),
+        namespace: Optional[str] = None,
+        name: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """Analyze the resources of the release matching the filters.
+
+        Unlike the Collector's analysis, the filters are applied before
+        reaching the cluster: only matching resources are fetched, and the
+        labelled listings are limited to the matching kinds and namespaces.
+        Returns the entries sorted by resource and the number of API calls.
+
+        @param kinds:     lower-case kinds to include, all when empty
+        @param namespace: only include resources in this namespace
+        @param name:      only include resources with this name
+        """
+
+        def wanted(rsc: HashableResource, by_name: bool = True) -> bool:
+            if kinds and rsc.kind.lower() not in kinds:
+                return False
+            if namespace is not None and rsc.namespace != namespace:
+                return False
+            return not by_name or name is None or rsc.name == name
+
+        labels = {APP_LABEL: self.model.app.name, MANIFEST_LABEL: self.name}
+        fields = {"metadata.name": name} if name else None
+        expected = self.resources
+        api_calls = 0
+
+        labelled = set()
+        for ns, kind in {
+            (r.namespace, type(r.resource)) for r in expected if wanted(r, False)
+        }:
+            api_calls += 1
+            try:
+                labelled |= {
+                    HashableResource(obj)
+                    for obj in self.client.list(
+                        kind, namespace=ns, labels=labels, fields=fields
+                    )
+                }
+            except (ApiError, HTTPError) as e:
+                raise ManifestClientError(f"Failed to list {kind.__name__}", e) from e
+
+        entries = []
+        for rsc in filter(wanted, expected):
+            api_calls += 1
+            try:
+                obj = HashableResource(
+                    self.client.get(
+                        type(rsc.resource), rsc.name, namespace=rsc.namespace
+                    )
+                )
+            except (ApiError, HTTPError):
+                state = "missing"
+            else:
+                state = "correct" if obj in labelled else "conflicting"
+            entries.append(self._entry(rsc, state))
+        entries += [
+            self._entry(rsc, "extra")
+            for rsc in labelled
+            if rsc not in expected and wanted(rsc)
+        ]
+        return sorted(entries, key=lambda e: e["resource"]), api_calls
+
+    @staticmethod
+    def _entry(rsc: HashableResource, state: str) -> Dict[str, str]:
+        return {
+            "resource": str(rsc),
+            "kind": rsc.kind,
+            "namespace": rsc.namespace or "",
+            "name": rsc.name,
+            "state": state,
+        }
+
+    def teardown_stages(self) -> List[List[HashableResource]]:
+        """Group the installed resources in the order they are removed.
+
+        The DaemonSet goes first so Multus stops before its RBAC and config
+        disappear, and the CRD goes last once nothing else refers to it.
+        """
+        installed = sorted(self.labelled_resources(), key=str)
+        first = [r for r in installed if r.kind in TEARDOWN_FIRST]
+        last = [r for r in installed if r.kind in TEARDOWN_LAST]
+        middle = [r for r in installed if r not in first and r not in last]
+        return [stage for stage in (first, middle, last) if stage]
+
+    def delete_manifests(self, **kwargs):
+        """Delete all installed manifests, each stage's resources concurrently.
+
+        Stages which completed in an earlier attempt are no longer labelled
+        in the cluster, so a retried teardown resumes with the next stage.
+        """
+        for stage in self.teardown_stages():
+            log.info(f"Deleting {', '.join(map(str, stage))}")
+            with ThreadPoolExecutor(max_workers=len(stage)) as pool:
+                futures = [
+                    pool.submit(self.delete_resources, rsc, **kwargs) for rsc in stage
+                ]
+            for future in futures:
+                future.result()
+
+    def images(self) -> Iterator[str]:
+        """Container images referenced by the rendered resources."""
+        for rsc in self.resources:
+            spec = getattr(rsc.resource, "spec", None)
+            pod_spec = getattr(getattr(spec, "template", None), "spec", None)
+            if pod_spec:
+                for container in (pod_spec.containers or []) + (
+                    pod_spec.initContainers or []
+                ):
+                    yield container.image
+
+    def preflight(self, check_registry: bool = True) -> List[str]:
+        """Verify the rendered release before it is applied.
+
+        Image references are checked concurrently against their registries,
+        and every resource is validated by the apiserver with a dry-run
+        apply. Returns the problems found.
+
+        @param check_registry: whether to check the images in their registry
+        """
+        problems = []
+        if check_registry:
+            for image, found in check_images(self.images()).items():
+                if found is False:
+                    problems.append(f"image {image} not found")
+        for rsc in self.resources:
+            try:
+                self.client.apply(rsc.resource, force=True, dry_run=True)
+            except (ApiError, HTTPError) as e:
+                problems.append(f"{rsc} rejected: {e}")
+        return problems
@@ -1,23 +1,119 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 """Module for managing Network Attachment Definitions"""
+import hashlib
+import json
 import logging
-import traceback
-from typing import List, Set
+import sys
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import yaml
-from cerberus import Validator
-from lightkube import Client, codecs
+from httpx import HTTPError
+from lightkube import ApiError, Client, codecs
 from lightkube.generic_resource import create_namespaced_resource
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.core_v1 import Namespace
+from lightkube.types import PatchType
 from ops.manifests import ManifestClientError
-from ops.manifests.manipulations import HashableResource
 from tenacity import retry
 from tenacity.retry import retry_if_exception_type
 from tenacity.stop import stop_after_attempt
 from tenacity.wait import wait_exponential
 
+from validation import TEMPLATE_KIND, load_schema, render_template, validate
+
 log = logging.getLogger(__file__)
 
+MANAGED_BY = {"app.kubernetes.io/managed-by": "charm-multus"}
+FIELD_MANAGER = "charm-multus"
+DELETE_WORKERS = 8
+
+
+class NADIdentity(NamedTuple):
+    """Compact identity of a managed NetworkAttachmentDefinition.
+
+    The digest covers the charm-owned content of the resource, so two
+    identities only compare equal when nothing the charm applies differs.
+    """
+
+    namespace: str
+    name: str
+    digest: str
+
+    @property
+    def config_digest(self) -> str:
+        """Digest of the resource's spec.config alone."""
+        return self.digest.partition(":")[0]
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """Namespace and name of the resource."""
+        return self.namespace, self.name
+
+    def __str__(self) -> str:
+        return f"NetworkAttachmentDefinition/{self.namespace}/{self.name}"
+
+
+@lru_cache(maxsize=1024)
+def _config_digest(config: Optional[str]) -> str:
+    return hashlib.sha256(json.dumps(config).encode()).hexdigest()[:32]
+
+
+def _digest(config: Optional[str], annotations: Mapping, labels: Mapping) -> str:
+    """Digest of the charm-owned content of a NetworkAttachmentDefinition."""
+    metadata = [sorted(annotations.items()), sorted(labels.items())]
+    metadata_digest = hashlib.sha256(json.dumps(metadata).encode()).hexdigest()[:32]
+    return f"{_config_digest(config)}:{metadata_digest}"
+
+
+def _managed_keys(metadata: ObjectMeta) -> Dict[str, Set[str]]:
+    """Annotations and labels of a resource which the charm's field manager set."""
+    keys: Dict[str, Set[str]] = {"annotations": set(), "labels": set()}
+    for entry in metadata.managedFields or []:
+        if entry.manager != FIELD_MANAGER:
+            continue
+        fields = (entry.fieldsV1 or {}).get("f:metadata") or {}
+        for section, managed in keys.items():
+            owned = {field[2:] for field in fields.get(f"f:{section}") or {}}
+            managed |= owned & set(getattr(metadata, section) or {})
+    return keys
+
+
+@lru_cache(maxsize=4096)
+def _shard_owner(namespace: str, units: Tuple[str, ...]) -> str:
+    """Rendezvous hash of a namespace onto one of the units."""
+    return max(units, key=lambda unit: zlib.crc32(f"{unit}/{namespace}".encode()))
+
+
+class Shard(NamedTuple):
+    """Share of the NetworkAttachmentDefinitions reconciled by one unit.
+
+    Namespaces are assigned to units by rendezvous hashing, so a change in
+    units only moves the namespaces of the units which joined or departed.
+    """
+
+    unit: str
+    units: Tuple[str, ...]
+
+    def owns(self, namespace: str) -> bool:
+        """Whether the namespace's NADs are reconciled by this unit."""
+        return bool(self.units) and _shard_owner(namespace, self.units) == self.unit
+
 
 class NetworkAttachDefinitions:
     """Class used for managing the lifecycle of the Network Attachment Definitions
@@ -30,8 +126,19 @@ class NetworkAttachDefinitions:
         @param client: lightkube client
         """
         self.client = client if client else Client()
-        self.resources: Set[HashableResource] = set()
-        self.validator = Validator()
+        self.resources: Set[NADIdentity] = set()
+        # owned NADs of the last applied or healed manifests, skipped ones too
+        self.expected: Set[NADIdentity] = set()
+        self.shard: Optional[Shard] = None
+        # monotonic time after which long running work stops with Incomplete
+        self.deadline: Optional[float] = None
+        # resources converged by an earlier, incomplete apply of the same manifests
+        self.checkpoint: Set[NADIdentity] = set()
+        # resourceVersion of the last list of managed NADs
+        self.resource_version = ""
+        # annotations and labels the charm set on the last listed NADs
+        self._managed: Dict[Tuple[str, str], Dict[str, Set[str]]] = {}
+        self._selected: Dict[str, List[str]] = {}
         self.nad_resource = create_namespaced_resource(
             "k8s.cni.cncf.io",
             "v1",
@@ -42,12 +149,12 @@ class NetworkAttachDefinitions:
     @property
     def schema(self) -> dict:
         """Load the NetworkAttachmentDefinition validation schema"""
-        try:
-            with open("schemas/NetworkAttachDefinition.yaml", "r") as f:
-                return yaml.safe_load(f)
-        except yaml.YAMLError:
-            log.error(f"Failed reading validation schema: {traceback.format_exc()}")
-            raise
+        return load_schema("NetworkAttachmentDefinition")
+
+    @property
+    def template_schema(self) -> dict:
+        """Load the NetworkAttachmentDefinitionTemplate validation schema"""
+        return load_schema(TEMPLATE_KIND)
 
     @retry(
         reraise=True,
@@ -55,44 +162,221 @@ class NetworkAttachDefinitions:
         wait=wait_exponential(max=10),
         stop=stop_after_attempt(3),
     )
-    def apply_manifests(self, manifests: str) -> None:
+    def apply_manifests(
+        self,
+        manifests: str,
+        create_namespaces: bool = False,
+        reject_ipam_conflicts: bool = False,
+    ) -> None:
+        """Apply the NAD manifests and scrub any other managed NADs.
+
+        @param manifests:             YAML documents of NetworkAttachmentDefinitions
+        @param create_namespaces:     create missing target namespaces before applying
+        @param reject_ipam_conflicts: fail validation on overlapping ipam ranges
+        """
         try:
-            resources = self._validate_and_load(manifests)
+            resources = self._validate_and_load(manifests, reject_ipam_conflicts)
         except (ValidationError, yaml.YAMLError) as e:
             log.error(e)
             raise
 
-        applied: Set[HashableResource] = set()
-        for rsc in resources:
-            log.info(f"Applying {rsc}")
+        resources = {rsc: body for rsc, body in resources.items() if self._owns(rsc)}
+        expected = set(resources)
+        resources = self._in_available_namespaces(resources, create_namespaces)
+        owned = {rsc.key: body for rsc, body in resources.items()}
+        installed = {rsc.key: rsc for rsc in self._list_resources(owned)}
+        applied: Set[NADIdentity] = resources.keys() & self.checkpoint
+        for rsc, body in resources.items():
+            if rsc in applied:
+                continue
+            if len(applied) > len(self.checkpoint) and self._out_of_time():
+                raise Incomplete(applied, resources.keys() - applied)
             try:
-                self.client.apply(rsc.resource, force=True)
+                self._converge(rsc, body, installed.get(rsc.key))
                 applied.add(rsc)
-            except ManifestClientError as e:
+            except (ApiError, HTTPError) as e:
                 log.exception(f"Failed applying {rsc}: {e}. Retrying...")
-                raise
+                raise ManifestClientError(f"Failed applying {rsc}", e) from e
 
         log.info(f"Applied {len(applied)} NetworkAttachmentDefinitions")
-        self.resources = applied
-        self.scrub_resources()
+        self.resources, self.expected = applied, expected
+        try:
+            self.scrub_resources(set(installed.values()))
+        except Incomplete as e:
+            raise Incomplete(applied, e.remaining) from e
 
-    def remove_resources(self) -> None:
+    def digests(self, manifests: str) -> Dict[str, str]:
+        """Digests of the owned NADs rendered from the manifests.
+
+        @param manifests: NAD manifests which have been validated before
+        """
+        return {
+            f"{rsc.namespace}/{rsc.name}": rsc.digest
+            for rsc in self._load(manifests)
+            if self._owns(rsc)
+        }
+
+    def heal_drift(self, manifests: str) -> Tuple[int, int]:
+        """Converge the managed NetworkAttachmentDefinitions on the manifests.
+
+        A single label-filtered list is compared with the expected
+        resources, then only drifted resources are re-applied and only
+        unexpected resources are deleted.
+
+        @param manifests: the last successfully applied NAD manifests
+        @returns: count of re-applied and deleted resources
+        """
+        expected = {
+            rsc: body for rsc, body in self._load(manifests).items() if self._owns(rsc)
+        }
+        owned = {rsc.key: body for rsc, body in expected.items()}
+        installed = {
+            rsc.key: rsc for rsc in self._list_resources(owned) if self._owns(rsc)
+        }
+
+        drifted = self._in_available_namespaces(
+            {
+                rsc: body
+                for rsc, body in expected.items()
+                if rsc != installed.get(rsc.key)
+            }
+        )
+        remnants = {rsc for key, rsc in installed.items() if key not in owned}
+        for rsc, body in drifted.items():
+            log.info(f"Re-applying drifted {rsc}")
+            try:
+                self._converge(rsc, body, installed.get(rsc.key))
+            except (ApiError, HTTPError) as e:
+                raise ManifestClientError(f"Failed applying {rsc}", e) from e
+        self._delete_resources(remnants)
+        self.expected = set(expected)
+
+        if drifted or remnants:
+            log.info(
+                f"Healed {len(drifted)} drifted and removed {len(remnants)} "
+                "unexpected NetworkAttachmentDefinitions"
+            )
+        return len(drifted), len(remnants)
+
+    def _converge(
+        self, rsc: NADIdentity, body: Dict, installed: Optional[NADIdentity]
+    ) -> None:
+        """Bring one installed NAD in line with its expected body.
+
+        Unchanged resources aren't written at all, and resources whose
+        spec.config is unchanged only receive a merge patch of their labels
+        and annotations. Anything else is server-side applied by the charm's
+        field manager, only forcing ownership of fields on a conflict.
+        Labels and annotations the charm set but no longer expects are
+        removed by nulls in a merge patch.
+        """
+        if installed == rsc:
+            log.debug(f"Unchanged {rsc}")
+            return
+        removed: Dict[str, Dict[str, None]] = {}
+        for section, keys in self._managed.get(rsc.key, {}).items():
+            if dropped := keys - set(body["metadata"].get(section) or {}):
+                removed[section] = dict.fromkeys(sorted(dropped))
+        if installed and installed.config_digest == rsc.config_digest:
+            log.info(f"Patching metadata of {rsc}")
+            metadata = {
+                k: {**removed.get(k, {}), **(body["metadata"].get(k) or {})}
+                for k in ("labels", "annotations")
+                if body["metadata"].get(k) or k in removed
+            }
+            self._patch_metadata(rsc, metadata)
+            return
+
+        log.info(f"Applying {rsc}")
+        obj = codecs.from_dict(body)
         try:
-            resources = self._list_resources()
-            self._delete_resources(resources)
-        except ManifestClientError:
-            raise
+            self.client.apply(obj, field_manager=FIELD_MANAGER)
+        except ApiError as e:
+            if e.status.code != 409:
+                raise
+            log.warning(f"Taking ownership of conflicting fields of {rsc}: {e}")
+            self.client.apply(obj, field_manager=FIELD_MANAGER, force=True)
+        if removed:
+            # the apply only prunes the fields it owns, not those merge patched
+            self._patch_metadata(rsc, removed)
 
-        log.info(f"Removed {len(resources)} NetworkAttachmentDefinitions")
+    def _patch_metadata(self, rsc: NADIdentity, metadata: Dict) -> None:
+        """Merge patch the labels and annotations of an installed NAD."""
+        self.client.patch(
+            self.nad_resource,
+            rsc.name,
+            {"metadata": metadata},
+            namespace=rsc.namespace,
+            patch_type=PatchType.MERGE,
+            field_manager=FIELD_MANAGER,
+        )
+
+    def _out_of_time(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def _owns(self, rsc: NADIdentity) -> bool:
+        """Whether the resource belongs to this unit's shard, if sharded."""
+        return self.shard is None or self.shard.owns(rsc.namespace)
+
+    def _in_available_namespaces(
+        self, resources: Dict[NADIdentity, Dict], create: bool = False
+    ) -> Dict[NADIdentity, Dict]:
+        """Filter out resources targeting unavailable namespaces.
 
-    def scrub_resources(self) -> None:
+        Every target namespace is checked with a single list call, so a
+        missing namespace is reported up front instead of failing its
+        resource in the middle of applying.
+
+        @param resources: NAD bodies keyed by identity
+        @param create:    create missing namespaces rather than skipping them
+        """
+        targets = {rsc.namespace for rsc in resources}
+        if not targets:
+            return resources
         try:
-            installed = self._list_resources()
-            remnants = installed.difference(self.resources)
-            self._delete_resources(remnants)
-        except ManifestClientError:
-            raise
+            phases = {
+                ns.metadata.name: ns.status and ns.status.phase
+                for ns in self.client.list(Namespace)
+            }
+            missing = targets - phases.keys()
+            if create:
+                for namespace in sorted(missing):
+                    log.info(f"Creating namespace {namespace}")
+                    self.client.create(Namespace(metadata=ObjectMeta(name=namespace)))
+                missing = set()
+        except (ApiError, HTTPError) as e:
+            raise ManifestClientError("Failed to prepare namespaces", e) from e
+
+        unavailable = missing | {
+            ns for ns in targets if phases.get(ns) == "Terminating"
+        }
+        if not unavailable:
+            return resources
+        skipped = {rsc for rsc in resources if rsc.namespace in unavailable}
+        log.warning(
+            f"Skipping {len(skipped)} NetworkAttachmentDefinitions in unavailable "
+            f"namespaces: {', '.join(sorted(unavailable))}"
+        )
+        return {rsc: body for rsc, body in resources.items() if rsc not in skipped}
 
+    def remove_resources(self) -> None:
+        """Delete every managed NAD."""
+        resources = self._list_resources()
+        self._delete_resources(resources)
+        log.info(f"Removed {len(resources)} NetworkAttachmentDefinitions")
+
+    def scrub_resources(self, installed: Optional[Set[NADIdentity]] = None) -> None:
+        """Delete managed NADs which weren't applied by this object.
+
+        @param installed: managed NADs in the cluster, listed when not provided
+        """
+        if installed is None:
+            installed = self._list_resources()
+        applied = {rsc.key for rsc in self.resources}
+        remnants = {
+            rsc for rsc in installed if rsc.key not in applied and self._owns(rsc)
+        }
+        self._delete_resources(remnants)
         log.info(f"Removed {len(remnants)} NetworkAttachmentDefinitions")
 
     @retry(
@@ -101,22 +385,122 @@ class NetworkAttachDefinitions:
         wait=wait_exponential(max=10),
         stop=stop_after_attempt(3),
     )
-    def _delete_resources(self, resources: Set[HashableResource]):
+    def _delete_resources(self, resources: Set[NADIdentity]):
+        """Delete resources, one worker per namespace running concurrently."""
+        by_namespace: Dict[str, List[NADIdentity]] = defaultdict(list)
+        for rsc in resources:
+            by_namespace[rsc.namespace].append(rsc)
+        if not by_namespace:
+            return
+
+        workers = min(DELETE_WORKERS, len(by_namespace))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            deleted = set().union(
+                *pool.map(self._delete_namespaced, by_namespace.values())
+            )
+        if len(deleted) < len(resources):
+            raise Incomplete(deleted, set(resources) - deleted)
+
+    def _delete_namespaced(self, resources: List[NADIdentity]) -> Set[NADIdentity]:
+        """Delete resources of one namespace until done or out of time."""
+        deleted: Set[NADIdentity] = set()
         for rsc in resources:
+            if deleted and self._out_of_time():
+                break
             try:
-                self.client.delete(
-                    type(rsc.resource), rsc.name, namespace=rsc.namespace
-                )
-            except ManifestClientError as e:
+                self.client.delete(self.nad_resource, rsc.name, namespace=rsc.namespace)
+            except ApiError as e:
+                if e.status.code != 404:
+                    log.error(f"Failed to remove {rsc}: {e}. Retrying...")
+                    raise ManifestClientError(f"Failed to remove {rsc}", e) from e
+            except HTTPError as e:
                 log.error(f"Failed to remove {rsc}: {e}. Retrying...")
-                raise
+                raise ManifestClientError(f"Failed to remove {rsc}", e) from e
+            deleted.add(rsc)
+        return deleted
 
-    def _load_and_wrap(self, manifests: str) -> List[HashableResource]:
-        resources = list(yaml.safe_load_all(manifests))
-        for rsc in resources:
-            labels = rsc["metadata"].setdefault("labels", {})
-            labels["app.kubernetes.io/managed-by"] = "charm-multus"
-        return [HashableResource(codecs.from_dict(rsc)) for rsc in resources]
+    def _identify(self, body: Mapping, owned: Optional[Mapping] = None) -> NADIdentity:
+        """Build the compact identity of a NAD body.
+
+        @param body:  NAD as a mapping
+        @param owned: NAD whose metadata names the annotations and labels of
+                      body which are part of the digest. Without it, body is
+                      assumed to be fully owned by the charm.
+        """
+        owned = owned or body
+        metadata = body["metadata"]
+        annotations = metadata.get("annotations") or {}
+        labels = metadata.get("labels") or {}
+        owned_metadata = owned["metadata"]
+        digest = _digest(
+            (body.get("spec") or {}).get("config"),
+            {k: annotations.get(k) for k in owned_metadata.get("annotations") or {}},
+            {k: labels.get(k) for k in owned_metadata.get("labels") or {}},
+        )
+        namespace = metadata.get("namespace") or self.client.namespace
+        return NADIdentity(sys.intern(namespace), sys.intern(metadata["name"]), digest)
+
+    def _load(self, manifests: str) -> Dict[NADIdentity, Dict]:
+        """Parse manifests into NAD bodies keyed by their identity.
+
+        Templates are expanded into one body for each of their namespaces.
+        """
+        return self._load_documents(yaml.safe_load_all(manifests))
+
+    def _load_documents(self, documents: Iterable[Dict]) -> Dict[NADIdentity, Dict]:
+        """Build NAD bodies keyed by their identity.
+
+        A later document with the namespace and name of an earlier one
+        replaces it, as applying both in turn would leave the later one.
+        Empty documents are ignored.
+        """
+        resources: Dict[Tuple[str, str], Tuple[NADIdentity, Dict]] = {}
+        for doc in documents:
+            if doc is None:
+                continue
+            bodies = self._expand(doc) if doc["kind"] == TEMPLATE_KIND else [doc]
+            for body in bodies:
+                metadata = body["metadata"]
+                metadata.setdefault("namespace", self.client.namespace)
+                metadata.setdefault("labels", {}).update(MANAGED_BY)
+                rsc = self._identify(body)
+                if rsc.key in resources:
+                    log.warning(f"Replacing duplicate definition of {rsc}")
+                resources[rsc.key] = rsc, body
+        return dict(resources.values())
+
+    def _expand(self, template: Dict) -> Iterator[Dict]:
+        """Generate the NAD bodies of a template.
+
+        Namespaces rendering the same config share a single config string.
+        """
+        spec = template["spec"]
+        namespaces = list(spec.get("namespaces") or [])
+        if spec.get("namespaceSelector"):
+            namespaces += self._selected_namespaces(spec["namespaceSelector"])
+
+        specs: Dict[str, Dict] = {}
+        for namespace, config in render_template(template, namespaces):
+            metadata = dict(template["metadata"], namespace=namespace)
+            metadata["labels"] = dict(metadata.get("labels") or {})
+            yield {
+                "apiVersion": template["apiVersion"],
+                "kind": "NetworkAttachmentDefinition",
+                "metadata": metadata,
+                "spec": specs.setdefault(config, {"config": config}),
+            }
+
+    def _selected_namespaces(self, selector: Mapping[str, str]) -> List[str]:
+        """Namespaces matching a selector, listed at most once per object."""
+        key = json.dumps(selector, sort_keys=True)
+        if key not in self._selected:
+            try:
+                listing = self.client.list(Namespace, labels=selector)
+                names = [ns.metadata.name for ns in listing]
+            except (ApiError, HTTPError) as e:
+                raise ManifestClientError("Failed to select namespaces", e) from e
+            self._selected[key] = names
+        return self._selected[key]
 
     @retry(
         reraise=True,
@@ -124,43 +508,80 @@ class NetworkAttachDefinitions:
         wait=wait_exponential(max=10),
         stop=stop_after_attempt(3),
     )
-    def _list_resources(self):
+    def _list_resources(
+        self, owned: Optional[Mapping[Tuple[str, str], Mapping]] = None
+    ) -> Set[NADIdentity]:
+        """List the identities of every managed NAD in the cluster.
+
+        The digest of an installed resource covers the annotations and labels
+        of its expected body, and those the charm set on it before, so one
+        dropped from the manifests is drifted too.
+
+        @param owned: expected NAD bodies by namespace and name, used to digest
+                      only the charm-owned content of the installed resources
+        """
+        owned = owned or {}
         try:
-            resources = set(
-                HashableResource(_)
-                for _ in self.client.list(
-                    self.nad_resource,
-                    labels={"app.kubernetes.io/managed-by": "charm-multus"},
-                    namespace="*",
-                )
+            resources = set()
+            self._managed = {}
+            listing = self.client.list(
+                self.nad_resource, labels=MANAGED_BY, namespace="*"
             )
+            for rsc in listing:
+                body = {
+                    "metadata": {
+                        "namespace": rsc.metadata.namespace,
+                        "name": rsc.metadata.name,
+                        "annotations": rsc.metadata.annotations,
+                        "labels": rsc.metadata.labels,
+                    },
+                    "spec": rsc.get("spec"),
+                }
+                key = rsc.metadata.namespace, rsc.metadata.name
+                self._managed[key] = managed = _managed_keys(rsc.metadata)
+                expected = owned.get(key, {"metadata": {}})["metadata"]
+                digested = {
+                    section: set(expected.get(section) or {}) | keys
+                    for section, keys in managed.items()
+                }
+                resources.add(self._identify(body, {"metadata": digested}))
+            version = getattr(listing, "resourceVersion", "")
+            self.resource_version = version if isinstance(version, str) else ""
             return resources
-        except ManifestClientError:
+        except (ApiError, HTTPError) as e:
             log.error(
                 "Failed to get Network Attachment Definitions in cluster. Retrying..."
             )
-            raise
+            raise ManifestClientError("Failed to list net-attach-defs", e) from e
 
-    def _validate_and_load(self, manifests: str) -> List[HashableResource]:
+    def _validate_and_load(
+        self, manifests: str, reject_ipam_conflicts: bool = False
+    ) -> Dict[NADIdentity, Dict]:
         try:
-            self._validate_manifests(manifests)
+            self._validate_manifests(manifests, reject_ipam_conflicts)
         except (ValidationError, yaml.YAMLError):
             raise
-        return self._load_and_wrap(manifests)
+        return self._load(manifests)
 
-    def _validate_manifests(self, manifests: str) -> None:
-        try:
-            errors = ""
-            nads = list(yaml.safe_load_all(manifests))
-            for nad in nads:
-                if not self.validator.validate(nad, self.schema):
-                    errors += yaml.safe_dump(self.validator.errors)
-
-            if errors:
-                raise ValidationError(errors)
-        except yaml.YAMLError:
-            log.error("Failed to parse NetworkAttachmentDefinitions")
-            raise
+    def _validate_manifests(
+        self, manifests: str, reject_ipam_conflicts: bool = False
+    ) -> None:
+        report = validate(manifests, self.client.namespace)
+        for conflict in report.conflicts:
+            log.warning(f"IPAM conflict: {conflict}")
+        if not report.valid(reject_ipam_conflicts):
+            raise ValidationError(report.message(reject_ipam_conflicts))
+
+
+class Incomplete(Exception):
+    """Exception to raise when the time budget runs out before
+    all Network Attachment Definitions are processed
+    """
+
+    def __init__(self, done: Set[NADIdentity], remaining: Set[NADIdentity]):
+        self.done = done
+        self.remaining = remaining
+        super().__init__(f"{len(remaining)} NetworkAttachmentDefinitions remaining")
 
 
 class ValidationError(Exception):
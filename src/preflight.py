@@ -0,0 +1,117 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for verifying container images before they are rolled out"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import httpx
+
+log = logging.getLogger(__file__)
+
+DOCKER_HUB = "registry-1.docker.io"
+# names of Docker Hub in image references, which don't serve the registry API
+DOCKER_HUB_ALIASES = {"docker.io", "index.docker.io", DOCKER_HUB}
+MANIFEST_TYPES = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
+)
+WORKERS = 8
+TIMEOUT = 5.0
+
+
+class ImageReference(NamedTuple):
+    """A container image split into its registry, repository and tag or digest."""
+
+    registry: str
+    repository: str
+    reference: str
+
+    @classmethod
+    def parse(cls, image: str) -> "ImageReference":
+        name, reference = image, "latest"
+        if "@" in name:
+            name, reference = name.split("@", 1)
+        elif ":" in name.rsplit("/", 1)[-1]:
+            name, reference = name.rsplit(":", 1)
+        first, _, rest = name.partition("/")
+        if rest and ("." in first or ":" in first or first == "localhost"):
+            registry, repository = first, rest
+        else:
+            registry, repository = DOCKER_HUB, name
+        if registry in DOCKER_HUB_ALIASES:
+            registry = DOCKER_HUB
+            if "/" not in repository:
+                repository = f"library/{repository}"
+        return cls(registry, repository, reference)
+
+    @property
+    def manifest_url(self) -> str:
+        return (
+            f"https://{self.registry}/v2/{self.repository}/manifests/{self.reference}"
+        )
+
+
+def _bearer_token(client: httpx.Client, challenge: str) -> Optional[str]:
+    """Request an anonymous token for a Bearer WWW-Authenticate challenge."""
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop("realm", None)
+    if not challenge.lower().startswith("bearer") or not realm:
+        return None
+    response = client.get(realm, params=params)
+    response.raise_for_status()
+    body = response.json()
+    return body.get("token") or body.get("access_token")
+
+
+def image_exists(image: str, client: httpx.Client) -> Optional[bool]:
+    """Check whether the registry serves a manifest for the image.
+
+    Returns None when the registry can't give a definitive answer, such as
+    when it is unreachable from this unit.
+    """
+    ref = ImageReference.parse(image)
+    headers = {"Accept": MANIFEST_TYPES}
+    try:
+        response = client.head(ref.manifest_url, headers=headers)
+        challenge = response.headers.get("www-authenticate", "")
+        if response.status_code == 401 and challenge:
+            token = _bearer_token(client, challenge)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+                response = client.head(ref.manifest_url, headers=headers)
+    except httpx.HTTPError as e:
+        log.warning(f"Couldn't verify image {image}: {e}")
+        return None
+    if response.status_code == 404:
+        return False
+    if response.is_success:
+        return True
+    log.warning(f"Couldn't verify image {image}: HTTP {response.status_code}")
+    return None
+
+
+def check_images(
+    images: Iterable[str], client: Optional[httpx.Client] = None
+) -> Dict[str, Optional[bool]]:
+    """Check every image concurrently.
+
+    @param images: container image references
+    @param client: http client to reach the registries with
+    """
+    images = sorted(set(images))
+    if not images:
+        return {}
+    http = client or httpx.Client(timeout=TIMEOUT, follow_redirects=True)
+    try:
+        with ThreadPoolExecutor(max_workers=min(WORKERS, len(images))) as pool:
+            found = pool.map(lambda image: image_exists(image, http), images)
+            return dict(zip(images, found))
+    finally:
+        if client is None:
+            http.close()
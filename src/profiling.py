@@ -0,0 +1,111 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for profiling the charm's hook dispatch"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+ENV_VAR = "MULTUS_PROFILE"
+MARKER = "enabled"
+KEEP = 20  # profiles kept per unit, oldest are removed first
+FRAMES = 10  # stack depth recorded by tracemalloc
+
+
+def profile_dir() -> Path:
+    """Directory in the unit's state where profiles are written."""
+    return Path(os.environ.get("JUJU_CHARM_DIR", ".")) / ".profiles"
+
+
+def set_enabled(enabled: bool) -> None:
+    """Persist the profile-hooks config for the hooks dispatched next."""
+    marker = profile_dir() / MARKER
+    if enabled:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+    else:
+        marker.unlink(missing_ok=True)
+
+
+def is_enabled() -> bool:
+    """Whether profiling is enabled by config or the environment."""
+    if os.environ.get(ENV_VAR, "").lower() in ("1", "true", "yes"):
+        return True
+    return (profile_dir() / MARKER).exists()
+
+
+def _dispatch_name() -> str:
+    path = os.environ.get("JUJU_DISPATCH_PATH", "") or "dispatch"
+    return path.replace("/", "-")
+
+
+def _prune(directory: Path) -> None:
+    profiles = sorted(directory.glob("*.prof"))
+    for stale in profiles[:-KEEP]:
+        stale.unlink(missing_ok=True)
+        stale.with_suffix(".mem").unlink(missing_ok=True)
+
+
+@contextmanager
+def profiled() -> Iterator[None]:
+    """Profile CPU and memory of the wrapped dispatch when enabled.
+
+    Each dispatch writes a cProfile dump (.prof) and a tracemalloc
+    snapshot (.mem) named after the time and the hook or action.
+    """
+    if not is_enabled():
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    tracemalloc.start(FRAMES)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        directory = profile_dir()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            base = directory / f"{time.time_ns()}-{_dispatch_name()}"
+            profiler.dump_stats(base.with_suffix(".prof"))
+            snapshot.dump(str(base.with_suffix(".mem")))
+            _prune(directory)
+        except OSError:
+            log.exception("Failed to write the hook profile")
+
+
+def profiles(hook: Optional[str] = None) -> List[Path]:
+    """Profiles written so far, oldest first.
+
+    @param hook: only return the profiles of this hook or action
+    """
+    found = sorted(profile_dir().glob("*.prof"))
+    if hook:
+        name = hook.replace("/", "-")
+        found = [p for p in found if p.stem.partition("-")[2].endswith(name)]
+    return found
+
+
+def cpu_hotspots(paths: List[Path], top: int) -> str:
+    """The functions with the most cumulative time across the profiles."""
+    out = io.StringIO()
+    stats = pstats.Stats(*map(str, paths), stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return out.getvalue().strip()
+
+
+def memory_hotspots(path: Path, top: int) -> str:
+    """The lines holding the most memory at the end of one dispatch."""
+    snapshot = tracemalloc.Snapshot.load(str(path))
+    return "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
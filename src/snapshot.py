@@ -0,0 +1,50 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for the versioned reconcile snapshot kept in the charm's stored state"""
+import json
+import logging
+from typing import Any, Callable, Dict, Mapping
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+def _from_unversioned(snapshot: Dict, legacy: Mapping[str, Any]) -> Dict:
+    """Charms before the snapshot only kept the release and raw NAD manifest.
+
+    Nothing is known about what they rendered, so the fingerprint and
+    digests are left unknown and the next reconcile compares against the
+    cluster instead.
+    """
+    return {
+        "version": 1,
+        "manifests": {"release": legacy.get("release", ""), "fingerprint": ""},
+        "nads": {"digests": None, "resourceVersion": ""},
+    }
+
+
+# migrations from each version to the next
+MIGRATIONS: Dict[int, Callable[[Dict, Mapping[str, Any]], Dict]] = {
+    0: _from_unversioned,
+}
+
+
+def load(raw: str, legacy: Mapping[str, Any]) -> Dict:
+    """Load a stored snapshot, migrating it to the current version.
+
+    @param raw:    the stored JSON, empty before the snapshot existed
+    @param legacy: stored state kept before the snapshot existed
+    """
+    snapshot = json.loads(raw) if raw else {"version": 0}
+    if snapshot.get("version", 0) > VERSION:
+        log.warning(f"Discarding snapshot from newer version {snapshot['version']}")
+        snapshot = {"version": 0}
+    while snapshot["version"] < VERSION:
+        log.info(f"Migrating reconcile snapshot from version {snapshot['version']}")
+        snapshot = MIGRATIONS[snapshot["version"]](snapshot, legacy)
+    return snapshot
+
+
+def dump(snapshot: Mapping) -> str:
+    return json.dumps(snapshot, sort_keys=True)
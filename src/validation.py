@@ -0,0 +1,376 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Module for validating Network Attachment Definitions without a cluster
+
+The charm validates the network-attachment-definitions config through this
+module, and the same checks run standalone for bundles in CI:
+
+    python src/validation.py --jobs 4 --format json nads/*.yaml
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import string
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import yaml
+from cerberus import Validator
+
+from ipam import Gateway, Interval, find_conflicts, ipam_ranges
+
+log = logging.getLogger(__file__)
+
+TEMPLATE_KIND = "NetworkAttachmentDefinitionTemplate"
+SCHEMA_DIR = Path(__file__).resolve().parent.parent / "schemas"
+SCHEMAS = {
+    "NetworkAttachmentDefinition": "NetworkAttachDefinition.yaml",
+    TEMPLATE_KIND: "NetworkAttachDefinitionTemplate.yaml",
+}
+# documents per run handed to a worker process
+BATCH_SIZE = 500
+# stands for the namespaces a template selects, unknown without a cluster
+SELECTED = "<selected>"
+
+_TEMPLATE_MATCHES = string.Template.pattern.finditer
+_DOCUMENT_STARTS = re.compile(r"^(?=---(?:\s|$))", re.MULTILINE).split
+_DIRECTIVES = re.compile(r"^%", re.MULTILINE).search
+_validators = threading.local()
+
+
+class DocumentError(NamedTuple):
+    """Validation errors of one document in a bundle."""
+
+    index: int
+    kind: str
+    name: str
+    errors: Mapping
+
+    def as_dict(self) -> Dict:
+        return dict(self._asdict(), errors=dict(self.errors))
+
+
+class Report(NamedTuple):
+    """Outcome of validating one bundle of Network Attachment Definitions."""
+
+    source: str
+    documents: int
+    errors: List[DocumentError]
+    conflicts: List[str]
+
+    def valid(self, reject_ipam_conflicts: bool = False) -> bool:
+        return not self.errors and not (reject_ipam_conflicts and self.conflicts)
+
+    def message(self, reject_ipam_conflicts: bool = False) -> str:
+        """Describe the errors as the charm reports them in its status."""
+        message = "".join(yaml.safe_dump(dict(e.errors)) for e in self.errors)
+        if not self.errors and reject_ipam_conflicts and self.conflicts:
+            message += yaml.safe_dump({"ipam": self.conflicts})
+        return message
+
+    def as_dict(self, reject_ipam_conflicts: bool = False) -> Dict:
+        return {
+            "source": self.source,
+            "documents": self.documents,
+            "valid": self.valid(reject_ipam_conflicts),
+            "errors": [e.as_dict() for e in self.errors],
+            "conflicts": self.conflicts,
+        }
+
+
+def placeholders(text: str) -> Set[str]:
+    """Names of the ${placeholders} in a template string."""
+    return {
+        m.group("named") or m.group("braced")
+        for m in _TEMPLATE_MATCHES(text)
+        if m.group("named") or m.group("braced")
+    }
+
+
+@lru_cache(maxsize=None)
+def load_schema(kind: str) -> dict:
+    """Load the validation schema of a kind, reading each file once.
+
+    @param kind: NetworkAttachmentDefinition or its template kind
+    """
+    try:
+        with open(SCHEMA_DIR / SCHEMAS[kind], "r") as f:
+            return yaml.safe_load(f)
+    except yaml.YAMLError:
+        log.error(f"Failed reading validation schema: {traceback.format_exc()}")
+        raise
+
+
+def _validator(kind: str) -> Validator:
+    """Validator of a kind, one per thread as cerberus keeps state on it."""
+    validators = _validators.__dict__
+    if kind not in validators:
+        validators[kind] = Validator(load_schema(kind))
+    return validators[kind]
+
+
+def render_template(
+    template: Dict, namespaces: Iterable[str]
+) -> Iterator[Tuple[str, str]]:
+    """Render the config of a template for each of the namespaces.
+
+    Namespaces rendering the same config share a single config string.
+
+    @param template:   a NetworkAttachmentDefinitionTemplate
+    @param namespaces: namespaces to render the config for
+    """
+    spec = template["spec"]
+    config = string.Template(spec["config"])
+    names = sorted(placeholders(spec["config"]))
+    defaults = spec.get("defaults") or {}
+    substitutions = spec.get("substitutions") or {}
+    rendered: Dict[Tuple, str] = {}
+    for namespace in dict.fromkeys(namespaces):
+        values = {**defaults, **substitutions.get(namespace, {})}
+        values["namespace"] = namespace
+        key = tuple(values[k] for k in names)
+        if key not in rendered:
+            rendered[key] = config.substitute(values)
+        yield namespace, rendered[key]
+
+
+def template_errors(template: Dict) -> List[str]:
+    """Find placeholders of a template a namespace has no value for."""
+    spec = template["spec"]
+    names = placeholders(spec["config"]) - {"namespace"}
+    defaults = set(spec.get("defaults") or {})
+    substitutions = spec.get("substitutions") or {}
+    name = template["metadata"]["name"]
+    errors = []
+    if any(m.group("invalid") is not None for m in _TEMPLATE_MATCHES(spec["config"])):
+        errors.append(f"{name}: config has an invalid placeholder, use $$ for $")
+    if not spec.get("namespaces") and not spec.get("namespaceSelector"):
+        errors.append(f"{name}: requires namespaces or a namespaceSelector")
+    if spec.get("namespaceSelector") and names - defaults:
+        missing = ", ".join(sorted(names - defaults))
+        errors.append(f"{name}: selected namespaces have no defaults for {missing}")
+    for namespace in spec.get("namespaces") or []:
+        missing_ns = names - defaults - set(substitutions.get(namespace, {}))
+        if missing_ns:
+            missing = ", ".join(sorted(missing_ns))
+            errors.append(f"{name}: namespace {namespace} has no value for {missing}")
+    return errors
+
+
+def validate_document(index: int, doc) -> Optional[DocumentError]:
+    """Validate one document against the schema of its kind.
+
+    @param index: position of the document in its bundle
+    @param doc:   the parsed document
+    """
+    if not isinstance(doc, dict):
+        # scalars and sequences, which cerberus refuses to validate
+        return DocumentError(
+            index, "NetworkAttachmentDefinition", "", {"document": "must be a mapping"}
+        )
+    is_template = doc.get("kind") == TEMPLATE_KIND
+    kind = TEMPLATE_KIND if is_template else "NetworkAttachmentDefinition"
+    metadata = doc.get("metadata")
+    name = metadata.get("name") if isinstance(metadata, dict) else None
+    validator = _validator(kind)
+    if not validator.validate(doc):
+        return DocumentError(index, kind, str(name or ""), validator.errors)
+    if is_template and (errors := template_errors(doc)):
+        return DocumentError(index, kind, str(name), {"template": errors})
+    return None
+
+
+def _ipam_configs(
+    doc: Dict, default_namespace: str
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Configs of a document and the names identifying them in ipam reports.
+
+    Templates are rendered once for each distinct config of their namespaces,
+    the namespaces they select rendering with the defaults.
+    """
+    metadata = doc.get("metadata") or {}
+    if doc["kind"] != TEMPLATE_KIND:
+        namespace = metadata.get("namespace") or default_namespace
+        owner = f"NetworkAttachmentDefinition/{namespace}/{metadata.get('name')}"
+        yield owner, (doc.get("spec") or {}).get("config")
+        return
+    spec = doc["spec"]
+    namespaces = list(spec.get("namespaces") or [])
+    if spec.get("namespaceSelector"):
+        namespaces.append(SELECTED)
+    configs: Dict[str, str] = {}
+    for namespace, config in render_template(doc, namespaces):
+        configs.setdefault(config, namespace)
+    for config, namespace in configs.items():
+        yield f"{TEMPLATE_KIND}/{namespace}/{metadata.get('name')}", config
+
+
+class _Batch(NamedTuple):
+    """Outcome of validating a run of documents, indexed from 0."""
+
+    documents: int
+    errors: List[DocumentError]
+    intervals: List[Interval]
+    gateways: List[Gateway]
+
+
+def _validate_batch(manifests: str, default_namespace: str) -> _Batch:
+    """Parse and validate a run of documents.
+
+    Empty documents are ignored, as kubectl does. The ipam ranges are only
+    extracted once every document is valid, so every template renders.
+    """
+    docs = [doc for doc in yaml.safe_load_all(manifests) if doc is not None]
+    found = (validate_document(i, doc) for i, doc in enumerate(docs))
+    errors = [error for error in found if error]
+    intervals: List[Interval] = []
+    gateways: List[Gateway] = []
+    if not errors:
+        for doc in docs:
+            for owner, config in _ipam_configs(doc, default_namespace):
+                doc_intervals, doc_gateways = ipam_ranges(owner, config)
+                intervals += doc_intervals
+                gateways += doc_gateways
+    return _Batch(len(docs), errors, intervals, gateways)
+
+
+def _split(manifests: str, size: int) -> List[str]:
+    """Split a yaml stream at its --- markers into runs of documents."""
+    if _DIRECTIVES(manifests):
+        # %YAML and %TAG directives apply to the document after them
+        return [manifests]
+    pieces = [piece for piece in _DOCUMENT_STARTS(manifests) if piece]
+    return ["".join(pieces[i : i + size]) for i in range(0, len(pieces), size)]
+
+
+def validate(
+    manifests: str,
+    default_namespace: str = "default",
+    source: str = "",
+    jobs: int = 1,
+) -> Report:
+    """Validate a bundle of NADs and templates.
+
+    With more than one job, worker processes parse and validate runs of
+    documents split from the stream, as parsing costs as much as validating.
+    IPAM conflicts are only searched once every document is valid.
+
+    @param manifests:         multi-document yaml of the bundle
+    @param default_namespace: namespace of NADs which don't name one
+    @param source:            name of the bundle in the report
+    @param jobs:              worker processes validating runs of documents
+    """
+    runs = _split(manifests, BATCH_SIZE) if jobs > 1 else [manifests]
+    try:
+        if len(runs) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(runs))) as pool:
+                batches = list(
+                    pool.map(_validate_batch, runs, repeat(default_namespace))
+                )
+        else:
+            batches = [_validate_batch(manifests, default_namespace)]
+    except yaml.YAMLError:
+        log.error("Failed to parse NetworkAttachmentDefinitions")
+        raise
+
+    errors: List[DocumentError] = []
+    documents = 0
+    for batch in batches:
+        errors += [e._replace(index=e.index + documents) for e in batch.errors]
+        documents += batch.documents
+    conflicts = []
+    if not errors:
+        intervals = [i for batch in batches for i in batch.intervals]
+        gateways = [g for batch in batches for g in batch.gateways]
+        conflicts = find_conflicts(intervals, gateways)
+    return Report(source, documents, errors, conflicts)
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Validate NetworkAttachmentDefinition bundles"
+    )
+    parser.add_argument("files", nargs="+", help="yaml bundles, - for stdin")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes per bundle",
+    )
+    parser.add_argument(
+        "-n", "--namespace", default="default", help="namespace of unnamespaced NADs"
+    )
+    parser.add_argument(
+        "--reject-ipam-conflicts",
+        action="store_true",
+        help="fail bundles with overlapping ipam ranges",
+    )
+    parser.add_argument("--format", choices=["text", "json"], default="text")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Validate bundles from the command line.
+
+    Exits 0 when every bundle is valid, 1 on validation errors and
+    2 when a bundle can't be read or parsed.
+    """
+    args = _parse_args(argv)
+    reject = args.reject_ipam_conflicts
+    reports, failures = [], {}
+    start = time.perf_counter()
+    for path in args.files:
+        try:
+            text = sys.stdin.read() if path == "-" else Path(path).read_text()
+            reports.append(validate(text, args.namespace, path, args.jobs))
+        except (OSError, yaml.YAMLError) as e:
+            failures[path] = str(e)
+    elapsed = time.perf_counter() - start
+
+    if args.format == "json":
+        result = {
+            "valid": not failures and all(r.valid(reject) for r in reports),
+            "reports": [r.as_dict(reject) for r in reports],
+            "failures": failures,
+            "elapsed": round(elapsed, 3),
+        }
+        print(json.dumps(result, indent=2))
+    else:
+        for report in reports:
+            state = "valid" if report.valid(reject) else "invalid"
+            print(f"{report.source}: {report.documents} documents, {state}")
+            for error in report.errors:
+                print(f"  [{error.index}] {error.kind}/{error.name}: {error.errors}")
+            for conflict in report.conflicts:
+                print(f"  ipam: {conflict}")
+        for path, failure in failures.items():
+            print(f"{path}: {failure}")
+
+    if failures:
+        return 2
+    return 0 if all(r.valid(reject) for r in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
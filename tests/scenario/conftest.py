@@ -0,0 +1,39 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+from fake_apiserver import FakeApiServer
+from ops.testing import Harness
+
+from charm import MultusCharm
+from net_attach_definitions import NetworkAttachDefinitions
+
+
+@pytest.fixture
+def api():
+    yield FakeApiServer()
+
+
+@pytest.fixture(autouse=True)
+def hermetic(api, monkeypatch):
+    monkeypatch.setattr("ops.manifests.manifest.Client", api.client_factory())
+    monkeypatch.setattr("net_attach_definitions.Client", api.client_factory())
+    # image registries are out of scope, the apiserver dry-run still runs
+    monkeypatch.setattr("manifests.check_images", lambda images: {})
+    # retries hit the fake immediately instead of backing off for seconds
+    for method in (
+        NetworkAttachDefinitions.apply_manifests,
+        NetworkAttachDefinitions._delete_resources,
+        NetworkAttachDefinitions._list_resources,
+    ):
+        monkeypatch.setattr(method.retry, "sleep", lambda _: None)
+
+
+@pytest.fixture
+def harness():
+    harness = Harness(MultusCharm)
+    harness.set_leader(True)
+    try:
+        yield harness
+    finally:
+        harness.cleanup()
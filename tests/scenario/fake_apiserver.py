@@ -0,0 +1,475 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""In-process fake of the Kubernetes API for reconcile scenarios.
+
+The fake is an httpx transport, so a real lightkube Client talks to it
+without a network. It stores any resource kind by its URL, and supports
+label and field selectors, list pagination, server-side apply with
+field manager conflicts and pruning, merge patches, dry-runs and
+namespace cascading. Latency and failures are injected with Faults.
+"""
+
+import base64
+import copy
+import functools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+from lightkube import Client, KubeConfig
+from lightkube.config.models import Cluster, User
+
+SERVER = "https://fake-apiserver"
+WRITES = ("POST", "PUT", "PATCH", "DELETE")
+
+Key = Tuple[Optional[str], str]  # namespace, name
+
+
+class _Failure(Exception):
+    def __init__(self, code: int, reason: str, message: str):
+        super().__init__(message)
+        self.code, self.reason, self.message = code, reason, message
+
+
+@dataclass
+class Fault:
+    """A failure or delay injected into matching requests.
+
+    @param status:      HTTP status to answer with, 0 to only delay the request
+    @param method:      HTTP method to match, any when empty
+    @param path:        regular expression searched in the request path
+    @param times:       number of requests to fail, None for every one
+    @param latency:     seconds to wait before answering
+    """
+
+    status: int = 500
+    method: str = ""
+    path: str = ""
+    times: Optional[int] = 1
+    latency: float = 0.0
+
+    def matches(self, request: httpx.Request) -> bool:
+        if self.times is not None and self.times <= 0:
+            return False
+        if self.method and self.method != request.method:
+            return False
+        return re.search(self.path, request.url.path) is not None
+
+
+def _status(code: int, reason: str, message: str) -> Dict:
+    return {
+        "kind": "Status",
+        "apiVersion": "v1",
+        "metadata": {},
+        "status": "Failure" if code >= 400 else "Success",
+        "message": message,
+        "reason": reason,
+        "code": code,
+    }
+
+
+def _merge(target: Dict, patch: Mapping) -> Dict:
+    """Apply a JSON merge patch (RFC 7386) to a copy of target."""
+    result = copy.deepcopy(target)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, Mapping) and isinstance(result.get(key), dict):
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+def _fields(obj: Mapping) -> Dict:
+    """The fieldsV1 set of the fields an object sets, lists being atomic.
+
+    Null fields of a merge patch are kept as None, so merging the result
+    into an earlier set drops them.
+    """
+    return {
+        f"f:{key}": (
+            None
+            if value is None
+            else _fields(value) if isinstance(value, Mapping) else {}
+        )
+        for key, value in obj.items()
+    }
+
+
+def _prune(obj: Dict, previous: Mapping, current: Mapping) -> Dict:
+    """Remove the fields a manager applied before but no longer applies."""
+    for field, children in previous.items():
+        key = field[2:]
+        if field not in current:
+            obj.pop(key, None)
+        elif children and isinstance(obj.get(key), dict):
+            _prune(obj[key], children, current[field])
+    return obj
+
+
+def _present(fields: Mapping, obj: Mapping) -> Dict:
+    """The part of a fields set still present in the object."""
+    return {
+        field: (
+            _present(children, obj[field[2:]])
+            if children and isinstance(obj[field[2:]], Mapping)
+            else children
+        )
+        for field, children in fields.items()
+        if children is not None and field[2:] in obj
+    }
+
+
+def _managed(obj: Optional[Mapping], manager: str, operation: str) -> Dict:
+    """The fields set of a manager's operation on an object."""
+    entries = ((obj or {}).get("metadata") or {}).get("managedFields") or []
+    return next(
+        (
+            m.get("fieldsV1") or {}
+            for m in entries
+            if (m.get("manager"), m.get("operation")) == (manager, operation)
+        ),
+        {},
+    )
+
+
+def _label_selector(expr: str) -> Callable[[Mapping], bool]:
+    """Compile a label selector such as "a=b,c!=d,e in (f,g),!h"."""
+    requirement = re.compile(
+        r"^\s*(?P<neg>!)?(?P<key>[\w./-]+)\s*"
+        r"(?:(?P<op>==|=|!=)\s*(?P<value>[\w./-]*)"
+        r"|\s+(?P<set>in|notin)\s*\((?P<values>[^)]*)\))?\s*$"
+    )
+    tests = []
+    for req in filter(None, re.split(r",(?![^(]*\))", expr)):
+        m = requirement.match(req)
+        if not m:
+            raise _Failure(400, "BadRequest", f"invalid label selector {req!r}")
+        key, op, value = m["key"], m["op"], m["value"]
+        if m["set"]:
+            values = {v.strip() for v in m["values"].split(",")}
+            inside = m["set"] == "in"
+            tests.append(
+                lambda lbl, k=key, vs=values, i=inside: (lbl.get(k) in vs) == i
+            )
+        elif op:
+            equal = op != "!="
+            tests.append(lambda lbl, k=key, v=value, e=equal: (lbl.get(k) == v) == e)
+        else:
+            exists = not m["neg"]
+            tests.append(lambda lbl, k=key, e=exists: (k in lbl) == e)
+    return lambda labels: all(test(labels) for test in tests)
+
+
+def _field_selector(expr: str) -> Callable[[Mapping], bool]:
+    """Compile a field selector such as "metadata.name=a,metadata.namespace!=b"."""
+    tests = []
+    for req in filter(None, expr.split(",")):
+        m = re.match(r"^([\w.]+)\s*(==|=|!=)\s*(.*)$", req)
+        if not m:
+            raise _Failure(400, "BadRequest", f"invalid field selector {req!r}")
+        path, op, value = m.groups()
+
+        def field(obj, path=path):
+            for part in path.split("."):
+                obj = obj.get(part) if isinstance(obj, Mapping) else None
+            return "" if obj is None else str(obj)
+
+        equal = op != "!="
+        tests.append(lambda obj, f=field, v=value, e=equal: (f(obj) == v) == e)
+    return lambda obj: all(test(obj) for test in tests)
+
+
+class FakeApiServer(httpx.BaseTransport):
+    """Kubernetes API served in-process to lightkube clients."""
+
+    def __init__(self, namespaces=("default", "kube-system"), latency: float = 0.0):
+        self.latency = latency
+        self.faults: List[Fault] = []
+        self.requests: Counter = Counter()
+        self._objects: Dict[Tuple[str, str], Dict[Key, Dict]] = {}
+        self._version = 0
+        self._lock = threading.RLock()
+        for namespace in namespaces:
+            self.put("api/v1", "namespaces", {"metadata": {"name": namespace}})
+
+    def __deepcopy__(self, memo):
+        # lightkube deep copies its connection params, transport included
+        return self
+
+    # ---- helpers for scenarios ----
+
+    def client_factory(self, **kwargs) -> Callable[..., Client]:
+        """A drop-in replacement for lightkube.Client talking to this server."""
+        config = KubeConfig.from_one(
+            cluster=Cluster(server=SERVER), user=User(token="fake"), namespace="default"
+        )
+        return functools.partial(Client, config=config, transport=self, **kwargs)
+
+    def inject(self, *faults: Fault) -> None:
+        self.faults.extend(faults)
+
+    def objects(self, plural: str, namespace: Optional[str] = None) -> List[Dict]:
+        """Stored objects of a kind, optionally in one namespace."""
+        with self._lock:
+            return [
+                copy.deepcopy(obj)
+                for (_, kind), stored in self._objects.items()
+                if kind == plural
+                for (ns, _), obj in sorted(stored.items(), key=lambda i: str(i[0]))
+                if namespace is None or ns == namespace
+            ]
+
+    def put(self, prefix: str, plural: str, obj: Dict) -> Dict:
+        """Store an object directly, as if another client had written it."""
+        with self._lock:
+            return self._store(
+                prefix, plural, obj.get("metadata", {}).get("namespace"), obj
+            )
+
+    def count(self, method: str = "", plural: str = "") -> int:
+        """Number of requests received matching the method and kind."""
+        return sum(
+            n
+            for (m, p), n in self.requests.items()
+            if (not method or m == method) and (not plural or p == plural)
+        )
+
+    @property
+    def writes(self) -> int:
+        return sum(self.count(method) for method in WRITES)
+
+    def reset_counts(self) -> None:
+        self.requests.clear()
+
+    # ---- transport ----
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        time.sleep(self.latency)
+        prefix, namespace, plural, name = self._route(request.url.path)
+        self.requests[(request.method, plural)] += 1
+        try:
+            self._inject_faults(request)
+            with self._lock:
+                code, body = self._dispatch(request, prefix, namespace, plural, name)
+        except _Failure as e:
+            code, body = e.code, _status(e.code, e.reason, e.message)
+            headers = {}
+            if code == 429:
+                headers["Retry-After"] = "0"
+            return httpx.Response(code, json=body, headers=headers)
+        return httpx.Response(code, json=body)
+
+    def _inject_faults(self, request: httpx.Request) -> None:
+        with self._lock:
+            fault = next((f for f in self.faults if f.matches(request)), None)
+            if fault and fault.times is not None:
+                fault.times -= 1
+        if fault is None:
+            return
+        time.sleep(fault.latency)
+        if fault.status:
+            reason = {409: "Conflict", 429: "TooManyRequests"}.get(
+                fault.status, "InternalError"
+            )
+            raise _Failure(fault.status, reason, f"injected fault {fault.status}")
+
+    @staticmethod
+    def _route(path: str) -> Tuple[str, Optional[str], str, Optional[str]]:
+        parts = path.strip("/").split("/")
+        if parts[0] == "api":
+            prefix, rest = "/".join(parts[:2]), parts[2:]
+        else:
+            prefix, rest = "/".join(parts[:3]), parts[3:]
+        namespace = None
+        if len(rest) >= 3 and rest[0] == "namespaces":
+            namespace, rest = rest[1], rest[2:]
+        return prefix, namespace, rest[0], rest[1] if len(rest) > 1 else None
+
+    def _dispatch(self, request, prefix, namespace, plural, name) -> Tuple[int, Dict]:
+        params = request.url.params
+        stored = self._objects.setdefault((prefix, plural), {})
+        dry_run = params.get("dryRun") == "All"
+        if namespace and ("", namespace) not in self._objects.get(
+            ("api/v1", "namespaces"), {}
+        ):
+            if request.method != "GET" or name:
+                raise _Failure(404, "NotFound", f'namespaces "{namespace}" not found')
+
+        if request.method == "GET":
+            if name is None:
+                return 200, self._list(stored, namespace, params)
+            return 200, copy.deepcopy(self._get(stored, namespace, plural, name))
+
+        if request.method == "DELETE":
+            if name is None:
+                selector = _label_selector(params.get("labelSelector", ""))
+                for key, obj in list(stored.items()):
+                    if key[0] == namespace and selector(
+                        obj["metadata"].get("labels") or {}
+                    ):
+                        self._delete(prefix, plural, key)
+                return 200, _status(200, "", "deleted")
+            self._get(stored, namespace, plural, name)
+            if not dry_run:
+                self._delete(prefix, plural, (namespace or "", name))
+            return 200, _status(200, "", "deleted")
+
+        body = json.loads(request.content or b"{}")
+        manager = params.get("fieldManager", "")
+        existing = stored.get((namespace or "", name or body["metadata"]["name"]))
+        operation, fields = "Update", _fields(body)
+        if request.method == "POST":
+            if existing:
+                raise _Failure(
+                    409,
+                    "AlreadyExists",
+                    f'{plural} "{body["metadata"]["name"]}" already exists',
+                )
+            obj = body
+        elif request.method == "PUT":
+            self._get(stored, namespace, plural, name)
+            obj = body
+        else:
+            content_type = request.headers.get("content-type", "")
+            if content_type.startswith("application/apply-patch"):
+                operation = "Apply"
+                obj = self._apply(
+                    existing, body, manager, params.get("force") == "true"
+                )
+            elif content_type.startswith(
+                ("application/merge-patch", "application/strategic")
+            ):
+                obj = _merge(self._get(stored, namespace, plural, name), body)
+                fields = _merge(_managed(existing, manager, operation), fields)
+            else:
+                raise _Failure(
+                    415, "UnsupportedMediaType", f"unsupported patch {content_type}"
+                )
+
+        if dry_run:
+            return 200, obj
+        code = 200 if existing else 201
+        if manager:
+            managed = [
+                m
+                for m in (existing or {}).get("metadata", {}).get("managedFields", [])
+                if (m.get("manager"), m.get("operation")) != (manager, operation)
+            ]
+            managed.append(
+                {"manager": manager, "operation": operation, "fieldsV1": fields}
+            )
+            obj["metadata"]["managedFields"] = managed
+        return code, copy.deepcopy(self._store(prefix, plural, namespace, obj))
+
+    def _get(self, stored, namespace, plural, name) -> Dict:
+        obj = stored.get((namespace or "", name))
+        if obj is None:
+            raise _Failure(404, "NotFound", f'{plural} "{name}" not found')
+        return obj
+
+    def _list(self, stored, namespace, params) -> Dict:
+        labels = _label_selector(params.get("labelSelector", ""))
+        fields = _field_selector(params.get("fieldSelector", ""))
+
+        def selected(namespaced: Optional[str], obj: Dict) -> bool:
+            if namespace is not None and namespaced != namespace:
+                return False
+            return labels(obj["metadata"].get("labels") or {}) and fields(obj)
+
+        items = [obj for (ns, _), obj in sorted(stored.items()) if selected(ns, obj)]
+        start = 0
+        if token := params.get("continue"):
+            start = int(base64.b64decode(token))
+        limit = int(params.get("limit", 0)) or len(items)
+        page = items[start : start + limit]
+        metadata = {"resourceVersion": str(self._version)}
+        if start + limit < len(items):
+            metadata["continue"] = base64.b64encode(
+                str(start + limit).encode()
+            ).decode()
+        return {
+            "kind": "List",
+            "apiVersion": "v1",
+            "metadata": metadata,
+            "items": copy.deepcopy(page),
+        }
+
+    def _apply(
+        self, existing: Optional[Dict], body: Dict, manager: str, force: bool
+    ) -> Dict:
+        if existing is None:
+            return body
+        merged = _prune(
+            _merge(existing, body),
+            _managed(existing, manager, "Apply"),
+            _fields(body),
+        )
+        owners = {
+            m.get("manager") for m in existing["metadata"].get("managedFields", [])
+        }
+        changed = _strip(merged) != _strip(existing)
+        if changed and not force and owners and manager not in owners:
+            raise _Failure(
+                409, "Conflict", f"Apply failed with conflicts with {sorted(owners)}"
+            )
+        return merged
+
+    def _store(self, prefix, plural, namespace, obj) -> Dict:
+        stored = self._objects.setdefault((prefix, plural), {})
+        metadata = obj.setdefault("metadata", {})
+        namespace = namespace or metadata.get("namespace")
+        if namespace and plural != "namespaces":
+            metadata["namespace"] = namespace
+        key = (namespace or "", metadata["name"])
+        previous = stored.get(key)
+        self._version += 1
+        metadata["resourceVersion"] = str(self._version)
+        if previous:
+            old = previous["metadata"]
+            metadata["uid"] = old["uid"]
+            metadata["creationTimestamp"] = old["creationTimestamp"]
+            generation = old.get("generation", 1)
+            if obj.get("spec") != previous.get("spec"):
+                generation += 1
+            metadata["generation"] = generation
+        else:
+            metadata["uid"] = f"uid-{self._version}"
+            metadata["creationTimestamp"] = "2022-01-01T00:00:00Z"
+            metadata["generation"] = 1
+        # managers give up the fields removed from the object
+        metadata["managedFields"] = [
+            dict(m, fieldsV1=_present(m.get("fieldsV1") or {}, obj))
+            for m in metadata.get("managedFields") or []
+        ]
+        stored[key] = obj
+        return obj
+
+    def _delete(self, prefix, plural, key: Key) -> None:
+        self._objects[(prefix, plural)].pop(key, None)
+        if plural == "namespaces":
+            for (_, kind), stored in self._objects.items():
+                if kind != "namespaces":
+                    for child in [k for k in stored if k[0] == key[1]]:
+                        del stored[child]
+
+
+def _strip(obj: Dict) -> Dict:
+    """An object without the fields the server maintains."""
+    obj = copy.deepcopy(obj)
+    for field in (
+        "resourceVersion",
+        "uid",
+        "creationTimestamp",
+        "generation",
+        "managedFields",
+    ):
+        obj.get("metadata", {}).pop(field, None)
+    return obj
@@ -0,0 +1,62 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+from fake_apiserver import Fault
+from lightkube import ApiError
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.core_v1 import ConfigMap
+
+
+@pytest.fixture
+def client(api):
+    client = api.client_factory(field_manager="test")()
+    for i in range(25):
+        labels = {"tier": ["a", "b", "c"][i % 3]}
+        meta = ObjectMeta(name=f"cm-{i:02}", namespace="default", labels=labels)
+        client.create(ConfigMap(metadata=meta))
+    yield client
+
+
+def test_pagination(api, client):
+    api.reset_counts()
+    assert len(list(client.list(ConfigMap, chunk_size=10))) == 25
+    assert api.count("GET", "configmaps") == 3
+
+
+@pytest.mark.parametrize(
+    "labels,count",
+    [
+        pytest.param({"tier": "a"}, 9, id="Equals"),
+        pytest.param({"tier": ("b", "c")}, 16, id="In"),
+        pytest.param({"missing": None}, 0, id="Exists"),
+    ],
+)
+def test_label_selector(client, labels, count):
+    assert len(list(client.list(ConfigMap, labels=labels))) == count
+
+
+def test_field_selector(client):
+    (found,) = client.list(ConfigMap, fields={"metadata.name": "cm-07"})
+    assert found.metadata.labels == {"tier": "b"}
+
+
+def test_missing_namespace(client):
+    meta = ObjectMeta(name="cm", namespace="nowhere")
+    with pytest.raises(ApiError) as e:
+        client.create(ConfigMap(metadata=meta))
+    assert e.value.status.code == 404
+
+
+def test_dry_run(api, client):
+    meta = ObjectMeta(name="dry", namespace="default")
+    client.apply(ConfigMap(metadata=meta), dry_run=True)
+    assert len(api.objects("configmaps")) == 25
+
+
+def test_fault(api, client):
+    api.inject(Fault(status=429, method="GET", times=1))
+    with pytest.raises(ApiError) as e:
+        client.get(ConfigMap, "cm-00")
+    assert e.value.status.code == 429
+    assert client.get(ConfigMap, "cm-00").metadata.name == "cm-00"
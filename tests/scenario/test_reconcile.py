@@ -0,0 +1,314 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+import time
+
+import yaml
+from fake_apiserver import Fault
+from ops.model import ActiveStatus, BlockedStatus
+
+NADS = "network-attachment-definitions"
+
+
+def _nads(count, namespaces=("default",), subnet="10.{}.{}.0/24"):
+    docs = []
+    for i in range(count):
+        config = {
+            "cniVersion": "0.3.1",
+            "type": "macvlan",
+            "master": "eth1",
+            "ipam": {"type": "host-local", "subnet": subnet.format(i // 256, i % 256)},
+        }
+        docs.append(
+            {
+                "apiVersion": "k8s.cni.cncf.io/v1",
+                "kind": "NetworkAttachmentDefinition",
+                "metadata": {
+                    "name": f"net-{i}",
+                    "namespace": namespaces[i % len(namespaces)],
+                },
+                "spec": {"config": json.dumps(config)},
+            }
+        )
+    return yaml.safe_dump_all(docs)
+
+
+def test_install(api, harness):
+    harness.begin_with_initial_hooks()
+    assert [ds["metadata"]["name"] for ds in api.objects("daemonsets")] == [
+        "kube-multus-ds"
+    ]
+    assert api.objects("customresourcedefinitions")
+    assert harness.charm.stored.deployed
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_unset_option_is_pruned(api, harness):
+    harness.begin_with_initial_hooks()
+    harness.update_config({"daemonset-max-unavailable": "10%"})
+    (daemonset,) = api.objects("daemonsets")
+    assert daemonset["spec"]["updateStrategy"]["rollingUpdate"]["maxUnavailable"]
+
+    api.reset_counts()
+    harness.update_config(unset=["daemonset-max-unavailable"])
+    (daemonset,) = api.objects("daemonsets")
+    strategy = daemonset["spec"]["updateStrategy"]
+    assert "maxUnavailable" not in strategy.get("rollingUpdate", {})
+    assert api.count("PATCH", "daemonsets") == 1
+
+
+def _configure(harness, nads, **config):
+    harness.update_config({"network-attachment-definitions": nads, **config})
+
+
+def test_reconcile_at_scale(api, harness):
+    harness.begin_with_initial_hooks()
+    namespaces = tuple(f"tenant-{i}" for i in range(5))
+    nads = _nads(500, namespaces)
+    api.reset_counts()
+    _configure(harness, nads, **{"create-net-attach-def-namespaces": True})
+    assert len(api.objects(NADS)) == 500
+    assert api.count("POST", "namespaces") == 5
+    assert api.count("PATCH", NADS) == 500
+    assert api.count("GET", NADS) == 1
+
+    # an unchanged manifest costs no requests, a changed NAD one write
+    api.reset_counts()
+    harness.charm.on.config_changed.emit()
+    assert api.count(plural=NADS) == 0
+    _configure(harness, nads.replace("eth1", "eth2", 1))
+    assert api.count("PATCH", NADS) == 1
+    assert api.count("DELETE", NADS) == 0
+
+
+def test_throttled_apply_retries(api, harness):
+    harness.begin_with_initial_hooks()
+    api.inject(Fault(status=429, method="PATCH", path=NADS, times=2))
+    _configure(harness, _nads(20))
+    assert len(api.objects(NADS)) == 20
+    assert harness.charm.stored.nad_manifest
+
+
+def test_conflicting_owner_is_overridden(api, harness):
+    harness.begin_with_initial_hooks()
+    nads = _nads(3)
+    foreign = yaml.safe_load_all(nads.replace("eth1", "bond0"))
+    for obj in foreign:
+        obj["metadata"]["managedFields"] = [{"manager": "kubectl"}]
+        api.put("apis/k8s.cni.cncf.io/v1", NADS, obj)
+    _configure(harness, nads)
+    assert api.count("PATCH", NADS) == 6  # a conflict, then a forced apply
+    assert all("eth1" in nad["spec"]["config"] for nad in api.objects(NADS))
+
+
+def test_dropped_annotation_is_removed(api, harness):
+    harness.begin_with_initial_hooks()
+    (nad,) = yaml.safe_load_all(_nads(1))
+    nad["metadata"]["annotations"] = {"foo": "bar", "keep": "me"}
+    _configure(harness, yaml.safe_dump(nad))
+    del nad["metadata"]["annotations"]["foo"]
+    api.reset_counts()
+    _configure(harness, yaml.safe_dump(nad))
+    (installed,) = api.objects(NADS)
+    assert installed["metadata"]["annotations"] == {"keep": "me"}
+    assert api.count("PATCH", NADS) == 1
+
+    # the removal is settled
+    harness.charm.on.update_status.emit()
+    assert api.count("PATCH", NADS) == 1
+
+
+def test_partial_failure_converges_later(api, harness):
+    harness.begin_with_initial_hooks()
+    api.inject(Fault(status=500, method="PATCH", path=f"{NADS}/net-5$", times=None))
+    nads = _nads(10)
+    _configure(harness, nads)
+    assert not harness.charm.stored.nad_manifest
+    assert 5 <= len(api.objects(NADS)) < 10
+
+    api.faults.clear()
+    harness.charm.on.config_changed.emit()
+    assert len(api.objects(NADS)) == 10
+    assert harness.charm.stored.nad_manifest == nads
+
+
+def test_slow_apiserver_resumes_from_checkpoint(api, harness):
+    harness.update_config({"hook-time-budget": 1})
+    harness.begin_with_initial_hooks()
+    api.latency = 0.02
+    nads = _nads(100)
+    _configure(harness, nads)
+    assert 0 < len(api.objects(NADS)) < 100
+    assert harness.charm.stored.nad_checkpoint
+
+    hooks = 1
+    while not harness.charm.stored.nad_manifest:
+        harness.charm.nad_manager.deadline = time.monotonic() + 1  # a new hook
+        harness.framework.reemit()
+        hooks += 1
+    assert len(api.objects(NADS)) == 100
+    assert api.count("PATCH", NADS) == 100
+    assert hooks > 1
+
+
+def test_update_status_leaves_checkpointed_apply_alone(api, harness):
+    harness.update_config({"hook-time-budget": 1})
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(3))
+    api.latency = 0.02
+    _configure(harness, _nads(100, subnet="10.1{}.{}.0/24"))
+    assert harness.charm.stored.nad_checkpoint
+    applied = len(api.objects(NADS))
+
+    harness.charm.on.update_status.emit()
+    assert len(api.objects(NADS)) == applied
+
+    while harness.charm.stored.nad_checkpoint:
+        harness.charm.nad_manager.deadline = time.monotonic() + 1  # a new hook
+        harness.framework.reemit()
+    assert len(api.objects(NADS)) == 100
+
+
+def test_invalid_manifest_blocks(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, "kind: NetworkAttachmentDefinition\nmetadata: {}")
+    assert isinstance(harness.charm.unit.status, BlockedStatus)
+    assert api.objects(NADS) == []
+
+
+def test_remove(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(30, ("default", "kube-system")))
+    harness.charm.on.remove.emit()
+    assert api.objects(NADS) == []
+    assert api.objects("daemonsets") == []
+    assert api.objects("customresourcedefinitions") == []
+
+
+def test_forbidden_delete_blocks_remove(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(5))
+    api.inject(Fault(status=403, method="DELETE", path=NADS, times=None))
+    harness.charm.on.remove.emit()
+    assert isinstance(harness.charm.unit.status, BlockedStatus)
+    assert len(api.objects(NADS)) == 5
+    assert api.objects("daemonsets") != []
+
+
+def test_unchanged_upgrade_writes_nothing(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(50))
+    api.reset_counts()
+    harness.charm.on.upgrade_charm.emit()
+    harness.charm.on.config_changed.emit()
+    assert api.writes == 0
+    assert api.count(plural=NADS) == 0
+
+
+def test_upgrade_with_skipped_nads_writes_nothing(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(4, namespaces=("default", "missing")))
+    assert len(api.objects(NADS)) == 2
+    api.reset_counts()
+    harness.charm.on.upgrade_charm.emit()
+    assert not harness.charm.stored.nad_stale
+
+    # healing records the skipped NADs alike
+    harness.charm.on.update_status.emit()
+    harness.charm.on.upgrade_charm.emit()
+    assert not harness.charm.stored.nad_stale
+    assert api.writes == 0
+
+
+def test_upgrade_from_unversioned_state(api, harness):
+    harness.begin_with_initial_hooks()
+    _configure(harness, _nads(50))
+    harness.charm.stored.snapshot = ""  # as left by a charm before snapshots
+    api.reset_counts()
+    harness.charm.on.upgrade_charm.emit()
+    harness.charm.on.config_changed.emit()
+    assert api.writes == 0
+    assert api.count("GET", NADS) == 1  # confirmed by a single list
+    assert harness.charm.stored.snapshot
+
+
+def test_failed_reconcile_after_upgrade_keeps_nads(api, harness):
+    harness.begin_with_initial_hooks()
+    nads = _nads(10)
+    _configure(harness, nads)
+    state = json.loads(harness.charm.stored.snapshot)
+    state["nads"]["digests"] = {"default/net-0": "rendered-by-an-older-revision"}
+    harness.charm.stored.snapshot = json.dumps(state)
+    harness.charm.on.upgrade_charm.emit()
+    assert harness.charm.stored.nad_stale
+
+    api.inject(Fault(status=500, method="GET", path=f"{NADS}$", times=None))
+    harness.charm.on.config_changed.emit()
+    api.faults.clear()
+    harness.charm.on.update_status.emit()
+    assert len(api.objects(NADS)) == 10
+    assert harness.charm.stored.nad_manifest == nads
+
+    harness.charm.on.config_changed.emit()
+    assert not harness.charm.stored.nad_stale
+    assert len(api.objects(NADS)) == 10
+
+
+def _multus_pod(node, ready=True, generation=2):
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": f"kube-multus-ds-{node}",
+            "namespace": "kube-system",
+            "labels": {"name": "multus", "pod-template-generation": str(generation)},
+        },
+        "spec": {"nodeName": node, "containers": []},
+        "status": {
+            "phase": "Running",
+            "containerStatuses": [
+                {
+                    "name": "kube-multus",
+                    "image": "multus",
+                    "imageID": "",
+                    "ready": ready,
+                    "restartCount": 0 if ready else 7,
+                    "state": {} if ready else {"waiting": {"reason": "Error"}},
+                }
+            ],
+        },
+    }
+
+
+def test_health_of_thousands_of_nodes(api, harness):
+    harness.begin_with_initial_hooks()
+    nodes = 3000
+    (daemonset,) = api.objects("daemonsets")
+    annotations = daemonset["metadata"].setdefault("annotations", {})
+    annotations["deprecated.daemonset.template.generation"] = "2"
+    daemonset["status"] = {
+        "currentNumberScheduled": nodes,
+        "desiredNumberScheduled": nodes,
+        "numberMisscheduled": 0,
+        "numberReady": nodes - 1,
+        "numberAvailable": nodes - 1,
+        "numberUnavailable": 1,
+        "updatedNumberScheduled": nodes,
+        "observedGeneration": 1,
+    }
+    api.put("apis/apps/v1", "daemonsets", daemonset)
+    for i in range(nodes):
+        pod = _multus_pod(f"node-{i:04}", ready=i != 42, generation=1 + (i > 9))
+        api.put("api/v1", "pods", pod)
+
+    api.reset_counts()
+    output = harness.run_action("multus-health", {})
+    assert (
+        output.results["message"] == "Multus unready on 1/3000 nodes: node-0042 (Error)"
+    )
+    assert output.results["summary"]["ready"] == nodes - 1
+    assert output.results["summary"]["outdated"] == 10
+    assert output.results["rollout"].endswith("1 unavailable")
+    assert api.count("GET", "daemonsets") == 1
+    assert api.count("GET", "pods") == nodes // 500
@@ -16,6 +16,7 @@ def lk_client():
 @pytest.fixture(autouse=True)
 def lk_nad_client():
     with mock.patch("net_attach_definitions.Client", autospec=True) as mock_lightkube:
+        mock_lightkube.return_value.namespace = "default"
         yield mock_lightkube.return_value
 
 
@@ -28,8 +29,3 @@ def api_error_class():
             pass
 
     yield TestApiError
-
-
-class MockActionEvent:
-    def __init__(self, params):
-        self.params = params
@@ -3,22 +3,31 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
 import logging
 import unittest.mock as mock
 
 import ops.testing
 import pytest
-from conftest import MockActionEvent
+from lightkube.models.meta_v1 import ObjectMeta
 from ops.manifests import ManifestClientError
 from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from ops.testing import Harness
 from yaml import YAMLError
 
+import profiling
 from charm import MultusCharm
-from net_attach_definitions import ValidationError
+from health import HealthSummary, NodeHealth
+from net_attach_definitions import Incomplete, NADIdentity, ValidationError
 
 ops.testing.SIMULATE_CAN_CONNECT = True
 
+
+class MockActionEvent:
+    def __init__(self, params):
+        self.params = params
+
+
 TEST_NAD = """apiVersion: "k8s.cni.cncf.io/v1"
 kind: NetworkAttachmentDefinition
 metadata:
@@ -55,6 +64,20 @@ def harness():
         harness.cleanup()
 
 
+@pytest.fixture(autouse=True)
+def health():
+    with mock.patch("charm.MultusManifests.health") as mock_health:
+        mock_health.return_value = HealthSummary(0, {})
+        yield mock_health
+
+
+@pytest.fixture(autouse=True)
+def preflight():
+    with mock.patch("charm.MultusManifests.preflight") as mock_preflight:
+        mock_preflight.return_value = []
+        yield mock_preflight
+
+
 @pytest.fixture
 def charm(harness):
     harness.begin_with_initial_hooks()
@@ -68,6 +91,20 @@ def test_scrub_net_attach_defs(mock_scrub, charm):
     mock_scrub.assert_called_once()
 
 
+def test_scrub_net_attach_defs_ignores_budget(lk_client, harness):
+    harness.update_config({"hook-time-budget": 1})
+    harness.begin()
+    harness.charm.nad_manager.deadline = 0  # long passed
+    nad_resource = harness.charm.nad_manager.nad_resource
+    lk_client.list.return_value = [
+        nad_resource(metadata=ObjectMeta(name=f"nad-{n}", namespace="ns"), spec={})
+        for n in range(3)
+    ]
+    output = harness.run_action("scrub-net-attach-defs")
+    assert output.results["result"].startswith("Successfully scrubbed")
+    assert lk_client.delete.call_count == 3
+
+
 @pytest.mark.parametrize(
     "config_value,stored_value",
     [
@@ -81,7 +118,9 @@ def test_on_config_changed(mock_apply, harness, charm, config_value, stored_valu
     charm.stored.nad_manifest = stored_value
     harness.update_config({"network-attachment-definitions": config_value})
     if config_value or stored_value:
-        mock_apply.assert_called_once_with(config_value)
+        mock_apply.assert_called_once_with(
+            config_value, create_namespaces=False, reject_ipam_conflicts=False
+        )
         assert isinstance(charm.unit.status, ActiveStatus)
     else:
         mock_apply.assert_not_called()
@@ -112,6 +151,22 @@ def test_on_config_changed_api_error(mock_apply, harness, charm, caplog):
         assert "Failed to apply net-attach-def manifests:" in caplog.text
 
 
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.apply_manifests")
+def test_on_config_changed_incomplete(mock_apply, harness, charm):
+    done = NADIdentity("default", "flannel", "digest")
+    mock_apply.side_effect = Incomplete({done}, {done._replace(name="sriov")})
+    harness.update_config({"network-attachment-definitions": TEST_NAD})
+    assert charm.stored.nad_manifest == ""
+    assert [tuple(_) for _ in charm.stored.nad_checkpoint["applied"]] == [done]
+
+    # the deferred hook resumes from the checkpoint
+    mock_apply.side_effect = None
+    charm._on_config_changed(mock.MagicMock())
+    assert charm.nad_manager.checkpoint == {done}
+    assert charm.stored.nad_manifest == TEST_NAD
+    assert charm.stored.nad_checkpoint == {}
+
+
 @mock.patch("net_attach_definitions.NetworkAttachDefinitions.scrub_resources")
 def test_scrub_net_attach_defs_api_error(mock_scrub, harness, charm, caplog):
     mock_scrub.side_effect = ManifestClientError("foo")
@@ -127,39 +182,232 @@ def test_on_remove_api_error(mock_remove, harness, charm, caplog):
     mock_remove.side_effect = ManifestClientError("foo")
     harness.set_leader()
     with caplog.at_level(logging.INFO):
-        mock_event = mock.MagicMock()
-        charm._on_remove(mock_event)
-        mock_event.defer.assert_called_once()
-        assert "Failed to remove net-attach-defs from the cluster" in caplog.text
+        charm.on.remove.emit()
+    assert "Failed to remove net-attach-defs from the cluster" in caplog.text
+    assert isinstance(charm.unit.status, BlockedStatus)
+
+
+UNREADY = NodeHealth("node-1", "kube-multus-ds-x", False, 3, "CrashLoopBackOff", False)
 
 
 @pytest.mark.parametrize("deployed", [True, False])
-@pytest.mark.parametrize("unready", ["Waiting", ""])
-def test_update_status(harness, deployed, unready):
-    with mock.patch(
-        "charm.Collector.unready", new_callable=mock.PropertyMock, return_value=unready
-    ):
-        harness.set_leader()
-        harness.begin_with_initial_hooks()
-        charm = harness.charm
-        charm.stored.deployed = deployed
-        charm._update_status("mock-event")
-        if deployed:
-            if unready:
-                assert isinstance(charm.unit.status, WaitingStatus)
-            else:
-                assert isinstance(charm.unit.status, ActiveStatus)
-
-
-@mock.patch("charm.MultusManifests.apply_manifests")
-def test_install_or_upgrade(mock_apply, harness):
+@pytest.mark.parametrize("unready", [True, False])
+def test_update_status(health, harness, deployed, unready):
+    if unready:
+        health.return_value = HealthSummary(2, {"node-1": UNREADY})
+    harness.set_leader()
+    harness.begin_with_initial_hooks()
+    charm = harness.charm
+    charm.stored.deployed = deployed
+    charm._update_status("mock-event")
+    if deployed:
+        if unready:
+            assert charm.unit.status == WaitingStatus(
+                "Multus unready on 1/2 nodes: node-1 (CrashLoopBackOff); "
+                "1 nodes without a Multus pod"
+            )
+        else:
+            assert isinstance(charm.unit.status, ActiveStatus)
+
+
+def test_update_status_rollout(health, harness):
+    rollout = "Rolling out kube-multus-ds: 1/3 nodes updated, 2 unavailable"
+    health.return_value = HealthSummary(3, {"node-1": UNREADY}, rollout)
+    harness.begin_with_initial_hooks()
+    harness.charm.stored.deployed = True
+    harness.charm._update_status("mock-event")
+    assert harness.charm.unit.status == WaitingStatus(rollout)
+
+
+def test_update_status_health_api_error(health, harness):
+    health.side_effect = ManifestClientError("foo")
+    harness.begin_with_initial_hooks()
+    harness.charm.stored.deployed = True
+    harness.charm._update_status("mock-event")
+    assert harness.charm.unit.status == WaitingStatus("Waiting for kube-apiserver")
+
+
+def test_multus_health(health, harness):
+    ready = UNREADY._replace(node="node-2", ready=True, restarts=0, reason="")
+    health.return_value = HealthSummary(2, {"node-1": UNREADY, "node-2": ready})
+    harness.begin_with_initial_hooks()
+    output = harness.run_action("multus-health", {"nodes": "node-1 node-2 node-9"})
+    assert output.results["summary"]["unready"] == 1
+    assert output.results["message"].startswith("Multus unready on 1/2 nodes")
+    nodes = json.loads(output.results["nodes"])
+    assert [n["node"] for n in nodes] == ["node-1", "node-2"]
+    assert nodes[0]["restarts"] == 3
+
+
+@pytest.mark.parametrize("leader", [True, False])
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.heal_drift")
+def test_on_update_status_heals_drift(mock_heal, harness, leader):
+    harness.set_leader(leader)
+    harness.begin_with_initial_hooks()
+    harness.charm.stored.nad_manifest = TEST_NAD
+    harness.charm.on.update_status.emit()
+    if leader:
+        mock_heal.assert_called_once_with(TEST_NAD)
+    else:
+        mock_heal.assert_not_called()
+
+
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.heal_drift")
+def test_on_update_status_skips_heal_in_progress(mock_heal, harness):
+    harness.set_leader()
+    harness.begin_with_initial_hooks()
+    harness.charm.stored.nad_manifest = TEST_NAD
+    harness.charm.stored.nad_checkpoint = {"target": "x", "applied": []}
+    harness.charm.on.update_status.emit()
+    mock_heal.assert_not_called()
+
+
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.heal_drift")
+def test_on_update_status_heal_incomplete(mock_heal, harness, caplog):
+    remaining = {NADIdentity("default", "sriov", "digest")}
+    mock_heal.side_effect = Incomplete(set(), remaining)
+    harness.set_leader()
+    harness.begin_with_initial_hooks()
+    with caplog.at_level(logging.INFO):
+        harness.charm.on.update_status.emit()
+    assert "Continuing to heal net-attach-defs in the next hook" in caplog.text
+
+
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.heal_drift")
+def test_on_update_status_heal_api_error(mock_heal, harness, caplog):
+    mock_heal.side_effect = ManifestClientError("foo")
+    harness.set_leader()
+    harness.begin_with_initial_hooks()
+    with caplog.at_level(logging.INFO):
+        harness.charm.on.update_status.emit()
+    assert "Failed to heal net-attach-def drift" in caplog.text
+
+
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.apply_manifests")
+def test_nad_shards(mock_apply, harness):
+    harness.set_leader()
+    rel_id = harness.add_relation("multus-peers", "multus")
+    harness.add_relation_unit(rel_id, "multus/1")
+    harness.update_config({"shard-net-attach-defs": True})
+    harness.begin_with_initial_hooks()
+    charm = harness.charm
+    assert charm.nad_manager.shard.units == ("multus/0", "multus/1")
+    assert harness.get_relation_data(rel_id, "multus")["nad-shard-units"] == (
+        '["multus/0", "multus/1"]'
+    )
+    mock_apply.assert_called()
+
+    # multus/1 hasn't reported its shard yet
+    assert charm._pending_nad_shards() == ["multus/1"]
+    harness.update_relation_data(
+        rel_id, "multus/1", {"nad-shard-status": '{"shard": "multus/0,multus/1"}'}
+    )
+    assert charm._pending_nad_shards() == []
+
+    # a departing unit re-applies the shard of the remaining units
+    mock_apply.reset_mock()
+    harness.remove_relation_unit(rel_id, "multus/1")
+    mock_apply.assert_called_once()
+    assert charm.nad_manager.shard.units == ("multus/0",)
+
+
+@pytest.fixture
+def drifted():
+    with mock.patch("charm.MultusManifests.drifted") as mock_drifted:
+        mock_drifted.return_value = ["mock-resource"]
+        yield mock_drifted
+
+
+@mock.patch("charm.MultusManifests.apply_resources")
+def test_install_or_upgrade(mock_apply, drifted, harness):
     harness.set_leader()
     harness.disable_hooks()
     harness.begin()
     harness.charm._install_or_upgrade("mock_event")
-    mock_apply.assert_called_once()
+    resources = harness.charm.manifests.resources
+    mock_apply.assert_called_once_with(*resources)
+    drifted.assert_not_called()
     assert harness.charm.stored.deployed
 
+    # the rendered manifests haven't changed since they were applied
+    drifted.return_value = []
+    harness.charm._install_or_upgrade("mock_event")
+    drifted.assert_called_once_with()
+    mock_apply.assert_called_once()
+
+    # resources changed by hand are still restored
+    drifted.return_value = ["mock-daemonset"]
+    harness.charm._install_or_upgrade("mock_event")
+    mock_apply.assert_called_with("mock-daemonset")
+
+    # changed manifests are applied in full, pruning the fields they dropped
+    drifted.reset_mock()
+    harness.update_config({"daemonset-max-unavailable": "10%"})
+    harness.charm._install_or_upgrade("mock_event")
+    drifted.assert_not_called()
+    mock_apply.assert_called_with(*harness.charm.manifests.resources)
+
+    # the fingerprint of a snapshot from an earlier revision is unknown
+    harness.charm.stored.snapshot = ""
+    drifted.return_value = ["mock-daemonset"]
+    harness.charm._install_or_upgrade("mock_event")
+    mock_apply.assert_called_with(*harness.charm.manifests.resources)
+
+
+@mock.patch("charm.MultusManifests.apply_resources")
+def test_install_or_upgrade_preflight(mock_apply, drifted, preflight, harness):
+    harness.set_leader()
+    harness.disable_hooks()
+    harness.begin()
+    preflight.return_value = ["image docker.io/multus:v9 not found"]
+    harness.charm._install_or_upgrade("mock_event")
+    mock_apply.assert_not_called()
+    assert isinstance(harness.charm.unit.status, BlockedStatus)
+    assert "Preflight failed" in harness.charm.unit.status.message
+
+    # an already deployed charm stays blocked across update-status
+    harness.charm.stored.deployed = True
+    harness.charm._update_status("mock_event")
+    assert isinstance(harness.charm.unit.status, BlockedStatus)
+    assert "Preflight failed" in harness.charm.unit.status.message
+
+    # verified once per release switch
+    preflight.return_value = []
+    harness.charm._install_or_upgrade("mock_event")
+    harness.update_config({"daemonset-max-surge": "1"})
+    harness.charm._install_or_upgrade("mock_event")
+    assert preflight.call_count == 2
+    assert mock_apply.call_count == 2
+    assert harness.charm.stored.preflight_problems == []
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+@pytest.mark.parametrize(
+    "digests,reconciled",
+    [
+        pytest.param({"default/flannel": "digest"}, False, id="Unchanged"),
+        pytest.param({"default/flannel": "other"}, True, id="Rendered differently"),
+        pytest.param(None, True, id="Unknown"),
+    ],
+)
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.digests")
+def test_on_upgrade_charm(mock_digests, harness, digests, reconciled):
+    harness.begin()
+    harness.charm.stored.nad_manifest = TEST_NAD
+    harness.charm.stored.snapshot = json.dumps(
+        {
+            "version": 1,
+            "manifests": {"release": "", "fingerprint": ""},
+            "nads": {"digests": digests, "resourceVersion": "42"},
+        }
+    )
+    mock_digests.return_value = {"default/flannel": "digest"}
+    with mock.patch.object(harness.charm, "_install_or_upgrade") as mock_install:
+        harness.charm.on.upgrade_charm.emit()
+    mock_install.assert_called_once()
+    assert harness.charm.stored.nad_manifest == TEST_NAD
+    assert harness.charm.stored.nad_stale is reconciled
+
 
 @mock.patch("net_attach_definitions.NetworkAttachDefinitions.remove_resources")
 @mock.patch("charm.MultusManifests.delete_manifests")
@@ -170,19 +418,91 @@ def test_on_remove(mock_remove, mock_delete, harness):
     mock_delete.assert_called_once()
 
 
-@mock.patch("charm.Collector.list_versions")
-def test_list_versions(mock_list, harness):
+@mock.patch("net_attach_definitions.NetworkAttachDefinitions.remove_resources")
+@mock.patch("charm.MultusManifests.delete_manifests")
+def test_on_remove_ignores_budget(mock_delete, mock_remove, harness):
+    harness.update_config({"hook-time-budget": 1})
+    harness.begin_with_initial_hooks()
+    harness.charm.on.remove.emit()
+    assert harness.charm.nad_manager.deadline is None
+    mock_remove.assert_called_once_with()
+    mock_delete.assert_called_once()
+
+
+def test_list_versions(harness):
     harness.begin_with_initial_hooks()
-    harness.charm._list_versions("mock_event")
-    mock_list.assert_called_once_with("mock_event")
+    output = harness.run_action("list-versions", {"limit": 1})
+    releases = harness.charm.manifests.releases
+    assert output.results["multus-versions"] == releases[0]
+    assert output.results["stats"]["total"] == len(releases)
 
+    cursor = output.results["cursor"]
+    output = harness.run_action("list-versions", {"format": "json", "cursor": cursor})
+    assert json.loads(output.results["items"]) == releases[1:]
+    assert "cursor" not in output.results
 
-@mock.patch("charm.Collector.list_resources")
+
+ENTRIES = [
+    {"resource": f"ConfigMap/kube-system/{name}", "name": name, "state": state}
+    for name, state in [("a", "correct"), ("b", "missing"), ("c", "correct")]
+]
+
+
+@mock.patch("charm.MultusManifests.list_resources")
 def test_list_resources(mock_list, harness):
     harness.begin_with_initial_hooks()
-    mock_event = MockActionEvent({})
-    harness.charm._list_resources(mock_event)
-    mock_list.assert_called_once_with(mock_event, manifests="multus", resources="")
+    mock_list.return_value = ENTRIES, 4
+    output = harness.run_action(
+        "list-resources", {"resources": "ConfigMap", "namespace": "kube-system"}
+    )
+    mock_list.assert_called_once_with({"configmap"}, "kube-system", None)
+    assert output.results["multus-correct"] == (
+        "ConfigMap/kube-system/a\nConfigMap/kube-system/c"
+    )
+    assert output.results["multus-missing"] == "ConfigMap/kube-system/b"
+    assert output.results["stats"]["api-calls"] == 4
+
+
+@mock.patch("charm.MultusManifests.list_resources")
+def test_list_resources_paginated(mock_list, harness):
+    harness.begin_with_initial_hooks()
+    mock_list.return_value = ENTRIES, 4
+    pages, cursor = [], ""
+    while True:
+        params = {"format": "json", "limit": 2, "cursor": cursor}
+        output = harness.run_action("list-resources", params)
+        pages.append(json.loads(output.results["items"]))
+        if not (cursor := output.results.get("cursor")):
+            break
+    assert pages == [ENTRIES[:2], ENTRIES[2:]]
+
+    with pytest.raises(ops.testing.ActionFailed):
+        harness.run_action("list-resources", {"cursor": "***"})
+
+
+@mock.patch("charm.MultusManifests.list_resources")
+def test_list_resources_failure(mock_list, harness):
+    harness.begin_with_initial_hooks()
+    mock_list.side_effect = ManifestClientError("boo", "foo")
+    with pytest.raises(ops.testing.ActionFailed) as e:
+        harness.run_action("list-resources", {})
+    assert "Failed to list resources: boo -> foo" in e.value.message
+
+
+def test_profile_hotspots(harness, tmp_path, monkeypatch):
+    monkeypatch.setenv("JUJU_CHARM_DIR", str(tmp_path))
+    harness.begin_with_initial_hooks()
+    with pytest.raises(ops.testing.ActionFailed):
+        harness.run_action("profile-hotspots", {})
+
+    harness.update_config({"profile-hooks": True})
+    monkeypatch.setenv("JUJU_DISPATCH_PATH", "hooks/update-status")
+    with profiling.profiled():
+        harness.charm.on.update_status.emit()
+    output = harness.run_action("profile-hotspots", {"top": 50})
+    assert output.results["profiles"] == 1
+    assert output.results["latest"].endswith("hooks-update-status")
+    assert "_on_update_status" in output.results["cpu"]
 
 
 @mock.patch("charm.Collector.apply_missing_resources")
@@ -0,0 +1,160 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest.mock as mock
+
+import pytest
+from lightkube.models.apps_v1 import DaemonSetStatus
+from lightkube.models.core_v1 import (
+    ContainerState,
+    ContainerStateWaiting,
+    ContainerStatus,
+    PodSpec,
+    PodStatus,
+)
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import Pod
+from ops.manifests import ManifestClientError
+
+from health import UNSCHEDULED, HealthSummary, NodeHealth, evaluate, rollout_message
+
+
+def _pod(node, ready=True, restarts=0, waiting=None, generation=2, name=None):
+    state = ContainerState(waiting=ContainerStateWaiting(reason=waiting))
+    status = ContainerStatus(
+        image="multus",
+        imageID="",
+        name="kube-multus",
+        ready=ready,
+        restartCount=restarts,
+        state=state if waiting else None,
+    )
+    return Pod(
+        metadata=ObjectMeta(
+            name=name or f"kube-multus-ds-{node}",
+            labels={"pod-template-generation": str(generation)},
+        ),
+        spec=PodSpec(containers=[], nodeName=node),
+        status=PodStatus(phase="Running", containerStatuses=[status]),
+    )
+
+
+def _daemonset(desired, updated=None, available=None):
+    updated = desired if updated is None else updated
+    available = desired if available is None else available
+    return DaemonSet(
+        # the DaemonSet's generation also counts changes outside its template
+        metadata=ObjectMeta(
+            name="kube-multus-ds",
+            generation=5,
+            annotations={"deprecated.daemonset.template.generation": "2"},
+        ),
+        spec=None,
+        status=DaemonSetStatus(
+            currentNumberScheduled=desired,
+            desiredNumberScheduled=desired,
+            numberMisscheduled=0,
+            numberReady=available,
+            numberAvailable=available,
+            numberUnavailable=desired - available,
+            observedGeneration=5,
+            updatedNumberScheduled=updated,
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    "updated,available,message",
+    [
+        pytest.param(3, 3, None, id="Complete"),
+        pytest.param(
+            1,
+            2,
+            "Rolling out kube-multus-ds: 1/3 nodes updated, 1 unavailable",
+            id="In progress",
+        ),
+    ],
+)
+def test_rollout_message(updated, available, message):
+    assert rollout_message(_daemonset(3, updated, available)) == message
+
+
+@pytest.mark.parametrize(
+    "pod,ready,reason,outdated",
+    [
+        pytest.param(_pod("n1"), True, "", False, id="Ready"),
+        pytest.param(
+            _pod("n1", False, waiting="CrashLoopBackOff"),
+            False,
+            "CrashLoopBackOff",
+            False,
+            id="Crashing",
+        ),
+        pytest.param(_pod("n1", False), False, "Running", False, id="Unready"),
+        pytest.param(_pod("n1", generation=1), True, "", True, id="Outdated"),
+    ],
+)
+def test_node_health(pod, ready, reason, outdated):
+    health = NodeHealth.from_pod(pod, "2")
+    assert (health.ready, health.reason, health.outdated) == (ready, reason, outdated)
+
+
+def test_evaluate():
+    client = mock.MagicMock()
+    client.get.return_value = _daemonset(4)
+    client.list.return_value = iter(
+        [
+            _pod("n1"),
+            _pod("n2", False, restarts=5, waiting="ImagePullBackOff"),
+            # during a rollout the updated, ready pod of a node counts
+            _pod("n3", False, generation=1, name="old"),
+            _pod("n3", name="new"),
+            _pod(None, False),
+        ]
+    )
+    summary = evaluate(client, "kube-multus-ds", "kube-system", {"name": "multus"})
+    client.list.assert_called_once_with(
+        Pod, namespace="kube-system", labels={"name": "multus"}, chunk_size=500
+    )
+    assert summary.nodes["n3"].pod == "new"
+    assert [n.node for n in summary.unhealthy] == [UNSCHEDULED, "n2"]
+    assert summary.missing == 0
+    assert summary.restarts == 5
+    assert summary.rollout is None
+    assert summary.as_dict()["outdated"] == 0
+    assert summary.message(limit=1) == (
+        "Multus unready on 2/4 nodes: <unscheduled> (Running) +1 more"
+    )
+
+
+def test_evaluate_thousands_of_nodes():
+    client = mock.MagicMock()
+    client.get.return_value = _daemonset(5000)
+    client.list.return_value = [_pod(f"node-{i}") for i in range(4990)]
+    summary = evaluate(client, "kube-multus-ds", "kube-system", {})
+    assert summary.message() == "10 nodes without a Multus pod"
+    assert summary.as_dict()["ready"] == 4990
+
+
+def test_evaluate_api_error(api_error_class):
+    client = mock.MagicMock()
+    client.list.side_effect = api_error_class()
+    with pytest.raises(ManifestClientError):
+        evaluate(client, "kube-multus-ds", "kube-system", {})
+
+
+def test_evaluate_api_error_while_listing(api_error_class):
+    def pages():
+        yield _pod("n1")
+        raise api_error_class()
+
+    client = mock.MagicMock()
+    client.get.return_value = _daemonset(2)
+    client.list.return_value = pages()
+    with pytest.raises(ManifestClientError):
+        evaluate(client, "kube-multus-ds", "kube-system", {})
+
+
+def test_healthy_summary():
+    assert HealthSummary(0, {}).message() == ""
@@ -0,0 +1,105 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+
+import pytest
+
+from ipam import find_conflicts, ipam_ranges
+
+
+def _host_local(*ranges):
+    return json.dumps(
+        {"type": "macvlan", "ipam": {"type": "host-local", "ranges": [list(ranges)]}}
+    )
+
+
+def _whereabouts(**ipam):
+    return json.dumps(
+        {
+            "cniVersion": "0.3.1",
+            "plugins": [{"type": "macvlan", "ipam": {"type": "whereabouts", **ipam}}],
+        }
+    )
+
+
+def _conflicts(**configs):
+    intervals, gateways = [], []
+    for owner, config in configs.items():
+        nad_intervals, nad_gateways = ipam_ranges(owner, config)
+        intervals += nad_intervals
+        gateways += nad_gateways
+    return find_conflicts(intervals, gateways)
+
+
+@pytest.mark.parametrize(
+    "configs,expected",
+    [
+        pytest.param(
+            {
+                "a": _host_local({"subnet": "10.0.0.0/24"}),
+                "b": _host_local({"subnet": "10.0.1.0/24"}),
+            },
+            [],
+            id="Disjoint subnets",
+        ),
+        pytest.param(
+            {
+                "a": _host_local({"subnet": "10.0.0.0/16"}),
+                "b": _whereabouts(range="10.0.3.0/24"),
+            },
+            ["b (10.0.3.0-10.0.3.255) overlaps a (10.0.0.0-10.0.255.255)"],
+            id="Nested subnets",
+        ),
+        pytest.param(
+            {
+                "a": _host_local(
+                    {
+                        "subnet": "10.0.0.0/24",
+                        "rangeStart": "10.0.0.10",
+                        "rangeEnd": "10.0.0.99",
+                    }
+                ),
+                "b": _whereabouts(
+                    range="10.0.0.0/24",
+                    range_start="10.0.0.100",
+                    range_end="10.0.0.200",
+                ),
+            },
+            [],
+            id="Split subnet",
+        ),
+        pytest.param(
+            {
+                "a": _host_local({"subnet": "10.0.0.0/24", "gateway": "10.0.1.1"}),
+                "b": _whereabouts(range="10.0.1.0-10.0.1.50/24"),
+            },
+            ["gateway 10.0.1.1 of a is allocatable by b (10.0.1.0-10.0.1.50)"],
+            id="Gateway conflict",
+        ),
+        pytest.param(
+            {
+                "a": _host_local({"subnet": "fd00::/64"}),
+                "b": _host_local({"subnet": "10.0.0.0/8"}),
+            },
+            [],
+            id="Mixed IP versions",
+        ),
+        pytest.param(
+            {"a": _host_local({"subnet": "not-a-subnet"}), "b": "{NOT JSON"},
+            [],
+            id="Unparsable",
+        ),
+    ],
+)
+def test_find_conflicts(configs, expected):
+    assert _conflicts(**configs) == expected
+
+
+def test_find_conflicts_scales():
+    configs = {
+        f"nad-{n}": _host_local({"subnet": f"10.{n // 256}.{n % 256}.0/24"})
+        for n in range(5000)
+    }
+    configs["overlap"] = _host_local({"subnet": "10.3.0.0/16"})
+    assert len(_conflicts(**configs)) == 256
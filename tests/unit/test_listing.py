@@ -0,0 +1,50 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+
+from listing import InvalidCursor, encode_cursor, paginate, version_order
+
+ITEMS = ["a", "b", "c", "d", "e"]
+
+
+@pytest.mark.parametrize(
+    "limit,cursor,page,next_key",
+    [
+        pytest.param(0, "", ITEMS, None, id="Everything"),
+        pytest.param(2, "", ["a", "b"], "b", id="First page"),
+        pytest.param(2, "b", ["c", "d"], "d", id="Middle page"),
+        pytest.param(2, "d", ["e"], None, id="Last page"),
+        pytest.param(0, "e", [], None, id="Past the end"),
+    ],
+)
+def test_paginate(limit, cursor, page, next_key):
+    cursor = encode_cursor(cursor) if cursor else ""
+    result, next_cursor = paginate(ITEMS, str, limit, cursor)
+    assert result == page
+    assert next_cursor == (encode_cursor(next_key) if next_key else "")
+
+
+def test_paginate_resumes_after_removed_items():
+    _, cursor = paginate(ITEMS, str, 2)
+    page, _ = paginate(["b", "c", "d"], str, 2, cursor)
+    assert page == ["c", "d"]
+
+    # the item named by the cursor is gone too
+    page, _ = paginate(["a", "c", "d"], str, 2, cursor)
+    assert page == ["c", "d"]
+
+
+def test_paginate_versions():
+    releases = ["v4.0", "v3.10", "v3.9", "v3.4"]
+    kwargs = dict(order=version_order, reverse=True)
+    page, cursor = paginate(releases, str, 2, **kwargs)
+    assert page == ["v4.0", "v3.10"]
+    page, _ = paginate(["v4.0", "v3.9", "v3.4"], str, 2, cursor, **kwargs)
+    assert page == ["v3.9", "v3.4"]
+
+
+@pytest.mark.parametrize("cursor", ["***", "YQ"])
+def test_paginate_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        paginate(ITEMS, str, 2, cursor)
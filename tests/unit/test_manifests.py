@@ -0,0 +1,260 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import copy
+import json
+import unittest.mock as mock
+
+import pytest
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import ConfigMap
+from ops.manifests import ManifestClientError
+
+from manifests import MultusManifests
+
+
+@pytest.fixture
+def manifests():
+    charm = mock.MagicMock()
+    charm.model.app.name = "multus"
+    yield MultusManifests(charm, {"release": "v4.0"})
+
+
+def _daemonset(manifests):
+    return next(r for r in manifests.resources if r.kind == "DaemonSet").resource
+
+
+@pytest.mark.parametrize(
+    "config,expected",
+    [
+        pytest.param({}, None, id="Upstream default"),
+        pytest.param(
+            {"daemonset-max-unavailable": "10%", "daemonset-max-surge": "0"},
+            {"maxUnavailable": "10%", "maxSurge": 0},
+            id="Configured",
+        ),
+        pytest.param({"daemonset-max-unavailable": "many"}, None, id="Invalid value"),
+    ],
+)
+def test_update_strategy(manifests, config, expected):
+    manifests.charm_config.update(config)
+    strategy = _daemonset(manifests).spec.updateStrategy
+    assert strategy.type == "RollingUpdate"
+    if expected:
+        assert strategy.rollingUpdate.to_dict() == expected
+    else:
+        assert strategy.rollingUpdate is None
+
+
+def test_health(lk_client, manifests):
+    with mock.patch("manifests.evaluate") as mock_evaluate:
+        assert manifests.health() == mock_evaluate.return_value
+    mock_evaluate.assert_called_once_with(
+        lk_client, "kube-multus-ds", "kube-system", {"name": "multus"}
+    )
+
+
+def test_delete_manifests_ordered(lk_client, manifests):
+    installed = {r.kind: r for r in manifests.resources}
+    deleted = []
+    with mock.patch.object(
+        manifests, "labelled_resources", return_value=frozenset(installed.values())
+    ), mock.patch.object(
+        manifests, "delete_resources", side_effect=lambda rsc, **_: deleted.append(rsc)
+    ):
+        manifests.delete_manifests(ignore_not_found=True)
+    assert deleted[0].kind == "DaemonSet"
+    assert deleted[-1].kind == "CustomResourceDefinition"
+    assert set(deleted) == set(installed.values())
+
+
+def test_delete_manifests_stops_on_failure(lk_client, manifests):
+    with mock.patch.object(
+        manifests, "labelled_resources", return_value=frozenset(manifests.resources)
+    ), mock.patch.object(manifests, "delete_resources") as mock_delete:
+        mock_delete.side_effect = ManifestClientError("boom")
+        with pytest.raises(ManifestClientError):
+            manifests.delete_manifests()
+    (rsc,), _ = mock_delete.call_args
+    assert rsc.kind == "DaemonSet"
+
+
+def test_images(manifests):
+    assert {i.rsplit(":", 1)[0] for i in manifests.images()} == {
+        "ghcr.io/k8snetworkplumbingwg/multus-cni"
+    }
+
+
+@mock.patch("manifests.check_images")
+def test_preflight(mock_check, lk_client, api_error_class, manifests):
+    mock_check.side_effect = lambda images: {i: False for i in images}
+    lk_client.apply.side_effect = [api_error_class()] + [None] * 20
+    problems = manifests.preflight()
+    assert any(p.endswith("not found") for p in problems)
+    assert any("rejected" in p for p in problems)
+    for call in lk_client.apply.call_args_list:
+        assert call.kwargs == {"force": True, "dry_run": True}
+
+
+@mock.patch("manifests.check_images")
+def test_preflight_unverified_images(mock_check, lk_client, manifests):
+    mock_check.side_effect = lambda images: {i: None for i in images}
+    assert manifests.preflight() == []
+    assert manifests.preflight(check_registry=False) == []
+    mock_check.assert_called_once()
+
+
+def _labelled(rsc):
+    obj = rsc.resource.__class__.from_dict(rsc.resource.to_dict())
+    obj.metadata.labels = {
+        "juju.io/application": "multus",
+        "juju.io/manifest": "multus",
+    }
+    return obj
+
+
+def test_list_resources(lk_client, api_error_class, manifests):
+    expected = sorted(manifests.resources, key=str)
+    ds = next(r for r in expected if r.kind == "DaemonSet")
+    extra = ConfigMap(metadata=ObjectMeta(name="old", namespace=ds.namespace))
+
+    def list_labelled(kind, **_):
+        objs = [_labelled(r) for r in expected if r.kind == kind.__name__]
+        return objs + ([extra] if kind is ConfigMap else [])
+
+    def get(kind, name, namespace=None):
+        if kind is DaemonSet:
+            raise api_error_class()
+        return _labelled(next(r for r in expected if r.name == name))
+
+    manifests.client  # loads the generic resources
+    lk_client.reset_mock()
+    lk_client.list.side_effect = list_labelled
+    lk_client.get.side_effect = get
+    entries, api_calls = manifests.list_resources()
+    states = {e["resource"]: e["state"] for e in entries}
+    assert states.pop(str(ds)) == "missing"
+    assert states.pop(f"ConfigMap/{ds.namespace}/old") == "extra"
+    assert set(states.values()) == {"correct"}
+    assert api_calls == lk_client.list.call_count + lk_client.get.call_count
+
+
+def test_list_resources_filtered(lk_client, manifests):
+    ds = next(r for r in manifests.resources if r.kind == "DaemonSet")
+    manifests.client  # loads the generic resources
+    lk_client.reset_mock()
+    lk_client.list.return_value = []
+    entries, api_calls = manifests.list_resources({"daemonset"}, ds.namespace, ds.name)
+    assert [e["state"] for e in entries] == ["conflicting"]
+    assert api_calls == 2
+    lk_client.list.assert_called_once_with(
+        DaemonSet,
+        namespace=ds.namespace,
+        labels={"juju.io/application": "multus", "juju.io/manifest": "multus"},
+        fields={"metadata.name": ds.name},
+    )
+
+
+def _multus_conf(manifests):
+    cm = next(r for r in manifests.resources if r.name == "multus-cni-config")
+    return json.loads(cm.resource.data["cni-conf.json"])
+
+
+def _multus_args(manifests):
+    (container,) = _daemonset(manifests).spec.template.spec.containers
+    return container.args
+
+
+@pytest.mark.parametrize("release", ["v3.9.1", "v4.0"])
+def test_daemon_config_auto(manifests, release):
+    manifests.charm_config.update(
+        {
+            "release": release,
+            "multus-log-level": "error",
+            "multus-readiness-indicator-file": "/etc/cni/net.d/10-flannel.conflist",
+        }
+    )
+    assert _multus_args(manifests) == [
+        "--multus-conf-file=auto",
+        "--cni-version=0.3.1",
+        "--multus-log-level=error",
+        "--readiness-indicator-file=/etc/cni/net.d/10-flannel.conflist",
+    ]
+    assert "logLevel" not in _multus_conf(manifests)
+
+
+def test_daemon_config_configmap(manifests):
+    manifests.charm_config.update(
+        {
+            "multus-conf-mode": "configmap",
+            "multus-log-level": "loud",
+            "multus-log-file": "/var/log/multus.log",
+        }
+    )
+    assert _multus_args(manifests) == [
+        "--multus-conf-file=/tmp/multus-conf/70-multus.conf",
+        "--cni-version=0.3.1",
+    ]
+    conf = _multus_conf(manifests)
+    assert conf["logFile"] == "/var/log/multus.log"
+    assert "logLevel" not in conf
+    assert conf["type"] == "multus"
+
+
+@pytest.mark.parametrize(
+    "delegates,expected",
+    [
+        pytest.param('[{"name": "k8s-pod-network"}]', "k8s-pod-network", id="Set"),
+        pytest.param("", "default-cni-network", id="Upstream"),
+        pytest.param("[{", "default-cni-network", id="Invalid JSON"),
+        pytest.param('{"name": "x"}', "default-cni-network", id="Not a list"),
+        pytest.param("5", "default-cni-network", id="Scalar"),
+    ],
+)
+def test_daemon_config_delegates(manifests, delegates, expected):
+    manifests.charm_config.update(
+        {"multus-conf-mode": "configmap", "multus-delegates": delegates}
+    )
+    assert _multus_conf(manifests)["delegates"][0]["name"] == expected
+
+
+def test_daemon_config_invalid_mode(manifests):
+    manifests.charm_config.update({"multus-conf-mode": "manual"})
+    assert _multus_args(manifests)[0] == "--multus-conf-file=auto"
+
+
+def test_fingerprint(manifests):
+    fingerprint = manifests.fingerprint()
+    assert manifests.fingerprint() == fingerprint
+    manifests.charm_config.update({"multus-log-level": "debug"})
+    assert manifests.fingerprint() != fingerprint
+
+
+def test_drifted(lk_client, api_error_class, manifests):
+    rendered = {(r.kind, r.name): r.resource for r in manifests.resources}
+    missing = api_error_class()
+    missing.status.code = 404
+
+    def get(kind, name, namespace=None):
+        if kind is DaemonSet:
+            raise missing
+        installed = copy.deepcopy(rendered[kind.__name__, name].to_dict())
+        installed["metadata"]["uid"] = "server-default"
+        if name == "multus-cni-config":
+            installed["data"]["cni-conf.json"] = "{}"
+        return kind.from_dict(installed)
+
+    lk_client.get.side_effect = get
+    assert sorted(r.name for r in manifests.drifted()) == [
+        "kube-multus-ds",
+        "multus-cni-config",
+    ]
+
+
+def test_drifted_api_error(lk_client, api_error_class, manifests):
+    error = api_error_class()
+    error.status.code = 500
+    lk_client.get.side_effect = error
+    with pytest.raises(ManifestClientError):
+        manifests.drifted()
@@ -4,11 +4,21 @@ from unittest.mock import call
 
 import pytest
 import yaml
+from httpx import HTTPError
+from lightkube import codecs
+from lightkube.models.core_v1 import NamespaceStatus
 from lightkube.models.meta_v1 import ObjectMeta
-from lightkube.resources.core_v1 import Pod
-from ops.manifests.manipulations import HashableResource
+from lightkube.resources.core_v1 import Namespace
+from ops.manifests import ManifestClientError
 
-from net_attach_definitions import NetworkAttachDefinitions, ValidationError
+from net_attach_definitions import (
+    Incomplete,
+    NADIdentity,
+    NetworkAttachDefinitions,
+    Shard,
+    ValidationError,
+)
+from validation import load_schema
 
 VALID_YAML = """apiVersion: "k8s.cni.cncf.io/v1"
 kind: NetworkAttachmentDefinition
@@ -49,6 +59,17 @@ spec:
 """
 
 
+@pytest.fixture(autouse=True)
+def namespaces(lk_nad_client):
+    available = [Namespace(metadata=ObjectMeta(name=n)) for n in ("default", "mock-ns")]
+
+    def list_namespaces(resource, *args, **kwargs):
+        return available if resource is Namespace else mock.DEFAULT
+
+    lk_nad_client.list.side_effect = list_namespaces
+    yield available
+
+
 @pytest.mark.parametrize(
     "context_raised,manifest",
     [
@@ -67,6 +88,142 @@ def test_validate_manifests(context_raised, manifest):
         NetworkAttachDefinitions()._validate_manifests(manifest)
 
 
+TEMPLATE_YAML = """apiVersion: "k8s.cni.cncf.io/v1"
+kind: NetworkAttachmentDefinitionTemplate
+metadata:
+  name: macvlan
+  annotations:
+    k8s.v1.cni.cncf.io/resourceName: intel.com/sriov
+spec:
+  namespaces: [tenant-a, tenant-b, tenant-c]
+  defaults:
+    master: eth1
+  substitutions:
+    tenant-b:
+      master: eth2
+  config: |
+    {"type": "macvlan", "master": "${master}"}
+"""
+
+
+def test_load_template(lk_nad_client):
+    nad = NetworkAttachDefinitions()
+    resources = nad._validate_and_load(TEMPLATE_YAML)
+    assert sorted(rsc.key for rsc in resources) == [
+        ("tenant-a", "macvlan"),
+        ("tenant-b", "macvlan"),
+        ("tenant-c", "macvlan"),
+    ]
+    bodies = {rsc.namespace: body for rsc, body in resources.items()}
+    assert bodies["tenant-b"]["spec"]["config"] == (
+        '{"type": "macvlan", "master": "eth2"}\n'
+    )
+    # namespaces rendering the same config share it
+    assert bodies["tenant-a"]["spec"] is bodies["tenant-c"]["spec"]
+    assert bodies["tenant-a"]["metadata"]["labels"] == {
+        "app.kubernetes.io/managed-by": "charm-multus"
+    }
+    assert bodies["tenant-a"]["kind"] == "NetworkAttachmentDefinition"
+
+
+def test_load_template_selector(lk_nad_client, namespaces):
+    selected = [Namespace(metadata=ObjectMeta(name="tenant-d"))]
+    lk_nad_client.list.side_effect = lambda res, labels=None, **kw: (
+        selected if labels == {"tenant": "gold"} else mock.DEFAULT
+    )
+    manifest = TEMPLATE_YAML.replace(
+        "namespaces: [tenant-a, tenant-b, tenant-c]",
+        "namespaceSelector: {tenant: gold}",
+    )
+    resources = NetworkAttachDefinitions()._validate_and_load(manifest)
+    assert [rsc.key for rsc in resources] == [("tenant-d", "macvlan")]
+
+
+def test_heal_drift_follows_selection(lk_nad_client):
+    selected = ["tenant-a", "tenant-d"]
+    installed = []
+
+    def list_resources(res, labels=None, **kw):
+        if labels == {"tenant": "gold"}:
+            return [Namespace(metadata=ObjectMeta(name=n)) for n in selected]
+        if res is Namespace:
+            return [Namespace(metadata=ObjectMeta(name=f"tenant-{n}")) for n in "ade"]
+        return installed
+
+    lk_nad_client.list.side_effect = list_resources
+    manifest = TEMPLATE_YAML.replace(
+        "namespaces: [tenant-a, tenant-b, tenant-c]",
+        "namespaces: [tenant-a]\n  namespaceSelector: {tenant: gold}",
+    )
+    bodies = NetworkAttachDefinitions()._load(manifest).values()
+    installed[:] = [codecs.from_dict(body) for body in bodies]
+
+    # namespaces joining and leaving the selector are healed in one pass
+    selected[:] = ["tenant-e"]
+    assert NetworkAttachDefinitions().heal_drift(manifest) == (1, 1)
+    (obj,), _ = lk_nad_client.apply.call_args
+    assert obj.metadata.namespace == "tenant-e"
+    _, name = lk_nad_client.delete.call_args.args
+    assert (name, lk_nad_client.delete.call_args.kwargs) == (
+        "macvlan",
+        {"namespace": "tenant-d"},
+    )
+    selector_lists = [
+        c for c in lk_nad_client.list.call_args_list if c.kwargs.get("labels")
+    ]
+    assert [c.kwargs["labels"] for c in selector_lists] == [
+        {"tenant": "gold"},
+        {"tenant": "gold"},
+        {"app.kubernetes.io/managed-by": "charm-multus"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "old,new,message",
+    [
+        pytest.param(
+            "master: eth1", "other: eth1", "tenant-a has no value", id="Missing"
+        ),
+        pytest.param(
+            "namespaces: [tenant-a, tenant-b, tenant-c]\n  defaults:\n    master: eth1",
+            "namespaceSelector: {tenant: gold}",
+            "no defaults for master",
+            id="Selector without defaults",
+        ),
+        pytest.param(
+            "namespaces: [tenant-a, tenant-b, tenant-c]",
+            "defaults: {}",
+            "requires namespaces",
+            id="No namespaces",
+        ),
+        pytest.param('"${master}"', '"$5"', "invalid placeholder", id="Invalid"),
+        pytest.param(
+            "name: macvlan",
+            "name: macvlan\n  namespace: x",
+            "read-only",
+            id="Namespaced",
+        ),
+    ],
+)
+def test_validate_template(old, new, message):
+    with pytest.raises(ValidationError, match=message):
+        NetworkAttachDefinitions()._validate_manifests(TEMPLATE_YAML.replace(old, new))
+
+
+@pytest.mark.parametrize("reject", [True, False])
+def test_validate_manifests_ipam_conflicts(reject, caplog):
+    manifest = "---\n".join(
+        [VALID_YAML, VALID_YAML.replace("name: sriov", "name: sriov-2")]
+    )
+    with caplog.at_level(logging.WARNING):
+        if reject:
+            with pytest.raises(ValidationError, match="overlaps"):
+                NetworkAttachDefinitions()._validate_manifests(manifest, True)
+        else:
+            NetworkAttachDefinitions()._validate_manifests(manifest)
+    assert "IPAM conflict: NetworkAttachmentDefinition/default/sriov-2" in caplog.text
+
+
 @pytest.mark.parametrize(
     "context_raised,manifest",
     [
@@ -84,55 +241,37 @@ def test_validate_and_load(context_raised, manifest):
         assert resources
 
 
+def _nad(name, namespace="mock-ns"):
+    return codecs.from_dict(
+        {
+            "apiVersion": "k8s.cni.cncf.io/v1",
+            "kind": "NetworkAttachmentDefinition",
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {"config": "{}"},
+        }
+    )
+
+
 @pytest.mark.parametrize(
     "installed,resources,log_message",
     [
         pytest.param(
-            [
-                Pod(
-                    kind="Pod",
-                    metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-                )
-                for n in range(5)
-            ],
-            [
-                HashableResource(
-                    Pod(
-                        kind="Pod",
-                        metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-                    )
-                )
-                for n in range(0, 3)
-            ],
+            5,
+            {NADIdentity("mock-ns", f"nad-{n}", "digest") for n in range(3)},
             "Removed 2 NetworkAttachmentDefinitions",
             id="Remnants",
         ),
         pytest.param(
-            [
-                Pod(
-                    kind="Pod",
-                    metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-                )
-                for n in range(5)
-            ],
-            [
-                HashableResource(
-                    Pod(
-                        kind="Pod",
-                        metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-                    )
-                )
-                for n in range(5)
-            ],
+            5,
+            {NADIdentity("mock-ns", f"nad-{n}", "digest") for n in range(5)},
             "Removed 0 NetworkAttachmentDefinitions",
             id="Non Remnants",
         ),
     ],
 )
 def test_scrub_resources(lk_nad_client, installed, resources, log_message, caplog):
-    mock_list = lk_nad_client.list
-    mock_list.return_value = installed
     nad = NetworkAttachDefinitions()
+    lk_nad_client.list.return_value = [_nad(f"nad-{n}") for n in range(installed)]
     nad.resources = resources
     with caplog.at_level(logging.INFO):
         nad.scrub_resources()
@@ -140,24 +279,43 @@ def test_scrub_resources(lk_nad_client, installed, resources, log_message, caplo
 
 
 def test_remove_resources(lk_nad_client):
-    mock_list = lk_nad_client.list
+    nad = NetworkAttachDefinitions()
     mock_delete: mock.MagicMock = lk_nad_client.delete
-    resources = [
-        Pod(
-            kind="Pod",
-            metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-        )
-        for n in range(5)
-    ]
-    mock_list.return_value = resources
-    NetworkAttachDefinitions().remove_resources()
+    resources = [_nad(f"nad-{n}") for n in range(5)]
+    lk_nad_client.list.return_value = resources
+    nad.remove_resources()
     calls = [
-        call(type(rsc), rsc.metadata.name, namespace=rsc.metadata.namespace)
+        call(nad.nad_resource, rsc.metadata.name, namespace=rsc.metadata.namespace)
         for rsc in resources
     ]
     mock_delete.assert_has_calls(calls, any_order=True)
 
 
+def test_load_defaults_namespace():
+    nad = NetworkAttachDefinitions()
+    manifest = VALID_YAML.replace("  namespace: default\n", "")
+    (identity,) = nad._load(manifest)
+    assert identity.key == ("default", "sriov")
+    assert identity in nad._load(VALID_YAML)
+
+
+def test_load_duplicate_keeps_last(caplog):
+    changed = VALID_YAML.replace("10.123.123.0/24", "10.123.124.0/24")
+    with caplog.at_level(logging.WARNING):
+        resources = NetworkAttachDefinitions()._load(
+            "---\n".join([VALID_YAML, changed])
+        )
+    ((rsc, body),) = resources.items()
+    assert rsc.key == ("default", "sriov")
+    assert "10.123.124.0/24" in body["spec"]["config"]
+    assert "Replacing duplicate definition" in caplog.text
+
+
+def test_apply_manifests_ignores_empty_documents(lk_nad_client):
+    NetworkAttachDefinitions().apply_manifests(f"---\n{VALID_YAML}---\n")
+    assert lk_nad_client.apply.call_count == 1
+
+
 @pytest.mark.parametrize(
     "manifest,log_message",
     [
@@ -174,6 +332,33 @@ def test_apply_manifests(manifest, log_message, caplog):
         assert log_message in caplog.text
 
 
+@pytest.mark.parametrize(
+    "phase,create,applied",
+    [
+        pytest.param(None, False, 0, id="Missing"),
+        pytest.param(None, True, 1, id="Created"),
+        pytest.param("Terminating", True, 0, id="Terminating"),
+    ],
+)
+def test_apply_manifests_unavailable_namespace(
+    lk_nad_client, namespaces, phase, create, applied, caplog
+):
+    namespaces.pop(0)
+    if phase:
+        namespaces.append(
+            Namespace(
+                metadata=ObjectMeta(name="default"),
+                status=NamespaceStatus(phase=phase),
+            )
+        )
+    with caplog.at_level(logging.INFO):
+        NetworkAttachDefinitions().apply_manifests(VALID_YAML, create_namespaces=create)
+    assert lk_nad_client.create.called is (create and not phase)
+    assert lk_nad_client.apply.call_count == applied
+    if not applied:
+        assert "in unavailable namespaces: default" in caplog.text
+
+
 @pytest.mark.parametrize(
     "context_raised,manifest",
     [
@@ -194,45 +379,303 @@ def test_apply_manifests_raises(context_raised, manifest):
         NetworkAttachDefinitions().apply_manifests(manifest)
 
 
-def test_remove_resources_api_error(api_error_class, lk_nad_client, caplog):
+def test_remove_resources_api_error(
+    api_error_class, lk_nad_client, caplog, monkeypatch
+):
+    monkeypatch.setattr(
+        NetworkAttachDefinitions._list_resources.retry, "sleep", lambda _: None
+    )
     lk_nad_client.list.side_effect = api_error_class()
-    with pytest.raises(api_error_class):
+    with pytest.raises(ManifestClientError):
         NetworkAttachDefinitions().remove_resources()
-        assert "Failed to get Network Attachment Definitions" in caplog.text
+    assert "Failed to get Network Attachment Definitions" in caplog.text
+    assert lk_nad_client.list.call_count == 3
 
 
-def test_scrub_resources_api_error(api_error_class, lk_nad_client, caplog):
+def test_scrub_resources_api_error(api_error_class, lk_nad_client, caplog, monkeypatch):
+    monkeypatch.setattr(
+        NetworkAttachDefinitions._list_resources.retry, "sleep", lambda _: None
+    )
     lk_nad_client.list.side_effect = api_error_class()
-    with pytest.raises(api_error_class):
+    with pytest.raises(ManifestClientError):
         NetworkAttachDefinitions().scrub_resources()
-        assert "Failed to get Network Attachment Definitions" in caplog.text
+    assert "Failed to get Network Attachment Definitions" in caplog.text
+    assert lk_nad_client.list.call_count == 3
 
 
-def test_delete_resources_api_error(api_error_class, lk_nad_client, caplog):
-    lk_nad_client.delete.side_effect = api_error_class()
-    with pytest.raises(api_error_class):
-        resources = [
-            HashableResource(
-                Pod(
-                    kind="Pod",
-                    metadata=ObjectMeta(name=f"pod-{n}", namespace="mock-ns"),
-                )
-            )
-            for n in range(5)
-        ]
+@pytest.mark.parametrize(
+    "error",
+    [
+        pytest.param("api_error", id="ApiError"),
+        pytest.param(HTTPError("connection reset"), id="HTTPError"),
+    ],
+)
+def test_delete_resources_api_error(
+    api_error_class, lk_nad_client, caplog, monkeypatch, error
+):
+    monkeypatch.setattr(
+        NetworkAttachDefinitions._delete_resources.retry, "sleep", lambda _: None
+    )
+    lk_nad_client.delete.side_effect = (
+        api_error_class() if error == "api_error" else error
+    )
+    resources = {NADIdentity("mock-ns", f"nad-{n}", "digest") for n in range(5)}
+    with pytest.raises(ManifestClientError):
         NetworkAttachDefinitions()._delete_resources(resources)
-        assert "Retrying..." in caplog.text
+    assert "Retrying..." in caplog.text
+    assert lk_nad_client.delete.call_count == 3
 
 
-def test_apply_manifests_api_error(api_error_class, lk_nad_client, caplog):
+def test_apply_manifests_api_error(api_error_class, lk_nad_client, caplog, monkeypatch):
+    monkeypatch.setattr(
+        NetworkAttachDefinitions.apply_manifests.retry, "sleep", lambda _: None
+    )
     lk_nad_client.apply.side_effect = api_error_class()
-    with pytest.raises(api_error_class):
+    with pytest.raises(ManifestClientError):
         NetworkAttachDefinitions().apply_manifests(VALID_YAML)
-        assert "Failed applying" in caplog.text
+    assert "Failed applying" in caplog.text
+    assert lk_nad_client.apply.call_count == 3
+
+
+def test_apply_manifests_list_error(
+    api_error_class, lk_nad_client, caplog, monkeypatch
+):
+    for method in (
+        NetworkAttachDefinitions.apply_manifests,
+        NetworkAttachDefinitions._list_resources,
+    ):
+        monkeypatch.setattr(method.retry, "sleep", lambda _: None)
+    list_namespaces = lk_nad_client.list.side_effect
+
+    def list_resources(resource, *args, **kwargs):
+        if resource is Namespace:
+            return list_namespaces(resource, *args, **kwargs)
+        raise api_error_class()
+
+    lk_nad_client.list.side_effect = list_resources
+    with pytest.raises(ManifestClientError):
+        NetworkAttachDefinitions().apply_manifests(VALID_YAML)
+    assert "Failed to get Network Attachment Definitions" in caplog.text
+    lk_nad_client.apply.assert_not_called()
+
+
+def _installed(manifest, **changes):
+    nad = yaml.safe_load(manifest)
+    nad["metadata"]["labels"] = {"app.kubernetes.io/managed-by": "charm-multus"}
+    nad["metadata"].update(changes.pop("metadata", {}))
+    nad["spec"].update(changes)
+    return codecs.from_dict(nad)
+
+
+@pytest.mark.parametrize(
+    "installed,applied,deleted",
+    [
+        pytest.param(lambda: [_installed(VALID_YAML)], 0, 0, id="No drift"),
+        pytest.param(lambda: [], 1, 0, id="Deleted by hand"),
+        pytest.param(
+            lambda: [_installed(VALID_YAML, config="{}")], 1, 0, id="Edited config"
+        ),
+        pytest.param(
+            lambda: [
+                _installed(
+                    VALID_YAML,
+                    metadata={"annotations": {"k8s.v1.cni.cncf.io/resourceName": "x"}},
+                )
+            ],
+            1,
+            0,
+            id="Edited annotation",
+        ),
+        pytest.param(
+            lambda: [
+                _installed(VALID_YAML),
+                _installed(VALID_YAML, metadata={"name": "other"}),
+            ],
+            0,
+            1,
+            id="Unexpected",
+        ),
+    ],
+)
+def test_heal_drift(lk_nad_client, installed, applied, deleted):
+    nad = NetworkAttachDefinitions()
+    lk_nad_client.list.return_value = installed()
+    assert nad.heal_drift(VALID_YAML) == (applied, deleted)
+    writes = lk_nad_client.apply.call_count + lk_nad_client.patch.call_count
+    assert writes == applied
+    assert lk_nad_client.delete.call_count == deleted
+
+
+@pytest.mark.parametrize(
+    "installed,apply,patch",
+    [
+        pytest.param(lambda: [], 1, 0, id="Missing"),
+        pytest.param(lambda: [_installed(VALID_YAML)], 0, 0, id="Unchanged"),
+        pytest.param(
+            lambda: [_installed(VALID_YAML, metadata={"annotations": {}})],
+            0,
+            1,
+            id="Metadata only",
+        ),
+        pytest.param(
+            lambda: [_installed(VALID_YAML, config="{}")], 1, 0, id="Config changed"
+        ),
+    ],
+)
+def test_apply_manifests_minimal_writes(lk_nad_client, installed, apply, patch):
+    nad = NetworkAttachDefinitions()
+    lk_nad_client.list.return_value = installed()
+    nad.apply_manifests(VALID_YAML)
+    assert lk_nad_client.apply.call_count == apply
+    assert lk_nad_client.patch.call_count == patch
+    for call_args in lk_nad_client.apply.call_args_list:
+        assert call_args.kwargs == {"field_manager": "charm-multus"}
+    if patch:
+        _, name, body = lk_nad_client.patch.call_args.args
+        assert name == "sriov"
+        assert body == {
+            "metadata": {
+                "labels": {"app.kubernetes.io/managed-by": "charm-multus"},
+                "annotations": {"k8s.v1.cni.cncf.io/resourceName": "intel.com/sriov"},
+            }
+        }
+
+
+@pytest.mark.parametrize("config,apply", [("{}", 1), (None, 0)])
+def test_apply_manifests_removes_dropped_metadata(lk_nad_client, config, apply):
+    nad = NetworkAttachDefinitions()
+    metadata = {
+        "annotations": {"k8s.v1.cni.cncf.io/resourceName": "intel.com/sriov"},
+        "managedFields": [
+            {
+                "manager": "kubectl",
+                "fieldsV1": {"f:metadata": {"f:annotations": {"f:note": {}}}},
+            },
+            {
+                "manager": "charm-multus",
+                "fieldsV1": {
+                    "f:metadata": {"f:annotations": {"f:foo": {}, "f:gone": {}}}
+                },
+            },
+        ],
+    }
+    metadata["annotations"].update(foo="bar", note="set by hand")
+    changes = {"config": config} if config else {}
+    lk_nad_client.list.return_value = [
+        _installed(VALID_YAML, metadata=metadata, **changes)
+    ]
+    nad.apply_manifests(VALID_YAML)
+    assert lk_nad_client.apply.call_count == apply
+    _, name, body = lk_nad_client.patch.call_args.args
+    assert body["metadata"]["annotations"]["foo"] is None
+    assert not {"gone", "note"} & body["metadata"]["annotations"].keys()
+
+
+def test_apply_manifests_conflict(api_error_class, lk_nad_client, caplog):
+    conflict = api_error_class()
+    conflict.status.code = 409
+    lk_nad_client.apply.side_effect = [conflict, None]
+    with caplog.at_level(logging.INFO):
+        NetworkAttachDefinitions().apply_manifests(VALID_YAML)
+    assert lk_nad_client.apply.call_args.kwargs == {
+        "field_manager": "charm-multus",
+        "force": True,
+    }
+    assert "Taking ownership of conflicting fields" in caplog.text
+
+
+def test_heal_drift_api_error(api_error_class, lk_nad_client):
+    lk_nad_client.list.side_effect = api_error_class()
+    with pytest.raises(ManifestClientError):
+        NetworkAttachDefinitions().heal_drift(VALID_YAML)
+
+
+def test_shard_owns():
+    units = ("multus/0", "multus/1", "multus/2")
+    namespaces = [f"ns-{n}" for n in range(300)]
+    owners = {
+        unit: {ns for ns in namespaces if Shard(unit, units).owns(ns)} for unit in units
+    }
+    assert set().union(*owners.values()) == set(namespaces)
+    assert sum(map(len, owners.values())) == len(namespaces)
+    assert all(owned for owned in owners.values())
+
+    # removing a unit only moves the namespaces it owned
+    remaining = ("multus/0", "multus/1")
+    for unit in remaining:
+        assert owners[unit] <= {
+            ns for ns in namespaces if Shard(unit, remaining).owns(ns)
+        }
+    assert not Shard("multus/0", ()).owns("ns-0")
+
+
+def test_apply_manifests_sharded(lk_nad_client, namespaces):
+    nad = NetworkAttachDefinitions()
+    manifest = "---\n".join(
+        VALID_YAML.replace("namespace: default", f"namespace: ns-{n}")
+        for n in range(10)
+    )
+    namespaces.extend(Namespace(metadata=ObjectMeta(name=f"ns-{n}")) for n in range(10))
+    lk_nad_client.list.return_value = [_nad("sriov", f"ns-{n}") for n in range(10)]
+    nad.shard = Shard("multus/0", ("multus/0", "multus/1"))
+    nad.apply_manifests(manifest)
+    owned = {f"ns-{n}" for n in range(10) if nad.shard.owns(f"ns-{n}")}
+    assert {rsc.namespace for rsc in nad.resources} == owned
+    assert lk_nad_client.apply.call_count == len(owned)
+    lk_nad_client.delete.assert_not_called()
+
+
+def _many(count):
+    return "---\n".join(
+        VALID_YAML.replace("name: sriov", f"name: sriov-{n}") for n in range(count)
+    )
+
+
+def test_apply_manifests_time_budget(lk_nad_client):
+    nad = NetworkAttachDefinitions()
+    nad.deadline = 0
+    with pytest.raises(Incomplete) as exc:
+        nad.apply_manifests(_many(3))
+    assert lk_nad_client.apply.call_count == 1
+    assert len(exc.value.done) == 1 and len(exc.value.remaining) == 2
+
+    # resuming from the checkpoint makes progress on the remaining resources
+    nad.checkpoint = exc.value.done
+    with pytest.raises(Incomplete) as exc:
+        nad.apply_manifests(_many(3))
+    assert lk_nad_client.apply.call_count == 2
+    assert len(exc.value.done) == 2
+
+    nad.deadline = None
+    nad.checkpoint = exc.value.done
+    nad.apply_manifests(_many(3))
+    assert lk_nad_client.apply.call_count == 3
+    assert len(nad.resources) == 3
+
+
+def test_remove_resources_concurrently(api_error_class, lk_nad_client):
+    not_found = api_error_class()
+    not_found.status.code = 404
+    resources = [_nad(f"nad-{n}", f"ns-{n % 4}") for n in range(20)]
+    lk_nad_client.list.return_value = resources
+    lk_nad_client.delete.side_effect = [not_found] + [None] * 19
+    NetworkAttachDefinitions().remove_resources()
+    assert lk_nad_client.delete.call_count == 20
+
+
+def test_remove_resources_time_budget(lk_nad_client):
+    nad = NetworkAttachDefinitions()
+    nad.deadline = 0
+    lk_nad_client.list.return_value = [_nad(f"nad-{n}") for n in range(3)]
+    with pytest.raises(Incomplete) as exc:
+        nad.remove_resources()
+    assert len(exc.value.remaining) == 2
+    assert lk_nad_client.delete.call_count == 1
 
 
 @mock.patch("yaml.safe_load")
 def test_schema_not_found(mock_safe, caplog):
+    load_schema.cache_clear()
     mock_safe.side_effect = yaml.YAMLError("Error")
     with caplog.at_level(logging.INFO):
         with pytest.raises(yaml.YAMLError):
@@ -0,0 +1,69 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import httpx
+import pytest
+
+from preflight import ImageReference, check_images, image_exists
+
+
+@pytest.mark.parametrize(
+    "image,expected",
+    [
+        pytest.param(
+            "busybox", ("registry-1.docker.io", "library/busybox", "latest"), id="Hub"
+        ),
+        pytest.param(
+            "ghcr.io/k8snetworkplumbingwg/multus-cni:v4.0.2",
+            ("ghcr.io", "k8snetworkplumbingwg/multus-cni", "v4.0.2"),
+            id="Tagged",
+        ),
+        pytest.param(
+            "docker.io/busybox:1.36",
+            ("registry-1.docker.io", "library/busybox", "1.36"),
+            id="Hub alias",
+        ),
+        pytest.param(
+            "index.docker.io/multus/multus-cni",
+            ("registry-1.docker.io", "multus/multus-cni", "latest"),
+            id="Hub index alias",
+        ),
+        pytest.param(
+            "localhost:5000/multus@sha256:abc",
+            ("localhost:5000", "multus", "sha256:abc"),
+            id="Digest with port",
+        ),
+    ],
+)
+def test_image_reference(image, expected):
+    assert ImageReference.parse(image) == expected
+
+
+def _registry(request: httpx.Request) -> httpx.Response:
+    if request.url.host == "auth.example.com":
+        return httpx.Response(200, json={"token": "secret"})
+    if request.headers.get("authorization") != "Bearer secret":
+        challenge = 'Bearer realm="https://auth.example.com/token",service="reg"'
+        return httpx.Response(401, headers={"www-authenticate": challenge})
+    if request.url.path.endswith("/manifests/missing"):
+        return httpx.Response(404)
+    return httpx.Response(200)
+
+
+def test_check_images():
+    client = httpx.Client(transport=httpx.MockTransport(_registry))
+    found = check_images(
+        ["reg.example.com/multus:v4", "reg.example.com/multus:missing"], client
+    )
+    assert found == {
+        "reg.example.com/multus:missing": False,
+        "reg.example.com/multus:v4": True,
+    }
+
+
+def test_image_exists_unreachable():
+    def unreachable(request):
+        raise httpx.ConnectError("no route", request=request)
+
+    client = httpx.Client(transport=httpx.MockTransport(unreachable))
+    assert image_exists("reg.example.com/multus:v4", client) is None
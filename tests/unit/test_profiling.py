@@ -0,0 +1,55 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture(autouse=True)
+def charm_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("JUJU_CHARM_DIR", str(tmp_path))
+    monkeypatch.delenv(profiling.ENV_VAR, raising=False)
+    yield tmp_path
+
+
+def _hook(name, monkeypatch):
+    monkeypatch.setenv("JUJU_DISPATCH_PATH", name)
+    with profiling.profiled():
+        sorted(str(i) for i in range(1000))
+
+
+def test_disabled(charm_dir, monkeypatch):
+    _hook("hooks/install", monkeypatch)
+    assert not (charm_dir / ".profiles").exists()
+
+
+def test_enabled_by_config(charm_dir, monkeypatch):
+    profiling.set_enabled(True)
+    _hook("hooks/install", monkeypatch)
+    _hook("hooks/config-changed", monkeypatch)
+    found = profiling.profiles()
+    assert [p.stem.partition("-")[2] for p in found] == [
+        "hooks-install",
+        "hooks-config-changed",
+    ]
+    assert profiling.profiles("config-changed") == found[1:]
+    assert "cumulative" in profiling.cpu_hotspots(found, 5)
+    assert profiling.memory_hotspots(found[-1].with_suffix(".mem"), 5)
+
+    profiling.set_enabled(False)
+    assert not profiling.is_enabled()
+
+
+def test_enabled_by_env(monkeypatch):
+    monkeypatch.setenv(profiling.ENV_VAR, "1")
+    assert profiling.is_enabled()
+
+
+def test_prunes_old_profiles(monkeypatch):
+    monkeypatch.setattr(profiling, "KEEP", 2)
+    monkeypatch.setenv(profiling.ENV_VAR, "true")
+    for _ in range(3):
+        _hook("hooks/update-status", monkeypatch)
+    assert len(profiling.profiles()) == 2
+    assert len(list(profiling.profile_dir().glob("*.mem"))) == 2
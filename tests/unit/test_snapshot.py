@@ -0,0 +1,26 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+
+import snapshot
+
+
+def test_load_unversioned():
+    state = snapshot.load("", {"release": "v4.0@rocks.canonical.com"})
+    assert state == {
+        "version": snapshot.VERSION,
+        "manifests": {"release": "v4.0@rocks.canonical.com", "fingerprint": ""},
+        "nads": {"digests": None, "resourceVersion": ""},
+    }
+
+
+def test_load_current():
+    state = snapshot.load("", {})
+    state["manifests"]["fingerprint"] = "abc"
+    assert snapshot.load(snapshot.dump(state), {}) == state
+
+
+def test_load_newer_version():
+    raw = json.dumps({"version": snapshot.VERSION + 1, "future": True})
+    assert snapshot.load(raw, {}) == snapshot.load("", {})
@@ -0,0 +1,224 @@
+import json
+import threading
+import unittest.mock as mock
+
+import pytest
+import yaml
+
+import validation
+
+NAD_YAML = """apiVersion: "k8s.cni.cncf.io/v1"
+kind: NetworkAttachmentDefinition
+metadata:
+  name: {name}
+spec:
+  config: |
+    {{"type": "macvlan", "ipam": {{"type": "host-local", "subnet": "{subnet}"}}}}
+"""
+
+TEMPLATE_YAML = """apiVersion: "k8s.cni.cncf.io/v1"
+kind: NetworkAttachmentDefinitionTemplate
+metadata:
+  name: macvlan
+spec:
+  namespaces: [tenant-a]
+  config: |
+    {"type": "macvlan", "master": "${master}"}
+"""
+
+
+def _bundle(count: int, overlapping: bool = False) -> str:
+    return "---\n".join(
+        NAD_YAML.format(
+            name=f"nad-{i}", subnet="10.0.0.0/24" if overlapping else f"10.{i}.0.0/24"
+        )
+        for i in range(count)
+    )
+
+
+def test_validate_valid_bundle():
+    report = validation.validate(_bundle(3), source="bundle.yaml")
+    assert report.valid()
+    assert report.as_dict() == {
+        "source": "bundle.yaml",
+        "documents": 3,
+        "valid": True,
+        "errors": [],
+        "conflicts": [],
+    }
+
+
+def test_validate_document_errors():
+    bundle = "---\n".join([_bundle(1), "kind: NetworkAttachmentDefinition", ""])
+    report = validation.validate(bundle)
+    assert not report.valid()
+    (error,) = report.errors
+    assert (error.index, error.kind) == (1, "NetworkAttachmentDefinition")
+    assert error.errors["apiVersion"] == ["required field"]
+    assert "required field" in report.message()
+    assert report.conflicts == []
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        pytest.param("just a string\n", id="Scalar"),
+        pytest.param("- a list\n", id="Sequence"),
+    ],
+)
+def test_validate_non_mapping(document):
+    report = validation.validate("---\n".join([_bundle(1), document]))
+    (error,) = report.errors
+    assert error.index == 1
+    assert error.errors == {"document": "must be a mapping"}
+    assert "must be a mapping" in report.message()
+
+
+def test_validate_template_errors():
+    report = validation.validate(TEMPLATE_YAML)
+    (error,) = report.errors
+    assert (error.kind, error.name) == (validation.TEMPLATE_KIND, "macvlan")
+    assert error.errors == {
+        "template": ["macvlan: namespace tenant-a has no value for master"]
+    }
+
+
+@pytest.mark.parametrize("reject", [True, False])
+def test_validate_ipam_conflicts(reject):
+    report = validation.validate(_bundle(2, overlapping=True), "tenant")
+    assert report.conflicts == [
+        "NetworkAttachmentDefinition/tenant/nad-1 (10.0.0.0-10.0.0.255) overlaps "
+        "NetworkAttachmentDefinition/tenant/nad-0 (10.0.0.0-10.0.0.255)"
+    ]
+    assert report.valid(reject) is not reject
+    assert ("ipam" in report.message(reject)) is reject
+
+
+SUBNET_TEMPLATE_YAML = """apiVersion: "k8s.cni.cncf.io/v1"
+kind: NetworkAttachmentDefinitionTemplate
+metadata:
+  name: macvlan
+spec:
+  namespaces: [tenant-a, tenant-b, tenant-c]
+  {selector}
+  defaults: {{subnet: 10.9.0.0/24}}
+  substitutions:
+    tenant-a: {{subnet: 10.0.0.0/25}}
+    tenant-b: {{subnet: 10.1.0.0/24}}
+    tenant-c: {{subnet: 10.2.0.0/24}}
+  config: |
+    {{"type": "macvlan", "ipam": {{"type": "host-local", "subnet": "${{subnet}}"}}}}
+"""
+
+
+@pytest.mark.parametrize(
+    "selector,conflicts",
+    [
+        pytest.param(
+            "",
+            [
+                "NetworkAttachmentDefinition/default/nad-0 (10.0.0.0-10.0.0.255) "
+                "overlaps NetworkAttachmentDefinitionTemplate/tenant-a/macvlan "
+                "(10.0.0.0-10.0.0.127)"
+            ],
+            id="Namespaces",
+        ),
+        pytest.param(
+            "namespaceSelector: {tenant: 'true'}",
+            [
+                "NetworkAttachmentDefinition/default/nad-0 (10.0.0.0-10.0.0.255) "
+                "overlaps NetworkAttachmentDefinitionTemplate/tenant-a/macvlan "
+                "(10.0.0.0-10.0.0.127)",
+                "NetworkAttachmentDefinitionTemplate/<selected>/macvlan "
+                "(10.9.0.0-10.9.0.255) overlaps "
+                "NetworkAttachmentDefinition/default/nad-9 (10.9.0.0-10.9.0.255)",
+            ],
+            id="Selector",
+        ),
+    ],
+)
+def test_validate_template_ipam_conflicts(selector, conflicts):
+    nads = [NAD_YAML.format(name=f"nad-{i}", subnet=f"10.{i}.0.0/24") for i in (0, 9)]
+    bundle = "---\n".join(nads + [SUBNET_TEMPLATE_YAML.format(selector=selector)])
+    report = validation.validate(bundle)
+    assert report.errors == []
+    assert report.conflicts == conflicts
+    assert not report.valid(reject_ipam_conflicts=True)
+
+
+def test_validate_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(validation, "BATCH_SIZE", 4)
+    docs = [NAD_YAML.format(name=f"nad-{i}", subnet=f"10.{i}.0.0/24") for i in range(9)]
+    docs[6] = docs[6].replace("spec:", "other:")
+    bundle = "---\n".join(docs)
+    serial = validation.validate(bundle)
+    parallel = validation.validate(bundle, jobs=2)
+    assert parallel == serial
+    assert [e.index for e in parallel.errors] == [6]
+
+
+def test_validate_parallel_parse_error(monkeypatch):
+    monkeypatch.setattr(validation, "BATCH_SIZE", 2)
+    with pytest.raises(yaml.YAMLError):
+        validation.validate(_bundle(5) + "--- {NOT,A,\tYAML}\n", jobs=2)
+
+
+@pytest.mark.parametrize(
+    "manifests,expected",
+    [
+        pytest.param("a: 1\n---\nb: 2\n", ["a: 1\n", "---\nb: 2\n"], id="Implicit"),
+        pytest.param("--- {a: 1}\n---b: 2\n", ["--- {a: 1}\n---b: 2\n"], id="Inline"),
+        pytest.param(
+            "%YAML 1.1\n---\na: 1\n", ["%YAML 1.1\n---\na: 1\n"], id="Directive"
+        ),
+    ],
+)
+def test_split(manifests, expected):
+    assert validation._split(manifests, 1) == expected
+
+
+def test_load_schema_cached(monkeypatch):
+    monkeypatch.setattr(validation, "_validators", threading.local())
+    validation.load_schema.cache_clear()
+    with mock.patch("yaml.safe_load", wraps=yaml.safe_load) as safe_load:
+        for _ in range(3):
+            validation.validate(_bundle(2))
+    assert safe_load.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "bundles,expected",
+    [
+        pytest.param([_bundle(2)], 0, id="Valid"),
+        pytest.param([_bundle(2), TEMPLATE_YAML], 1, id="Invalid"),
+        pytest.param([_bundle(2, overlapping=True)], 1, id="Conflicts"),
+    ],
+)
+def test_main_json(tmp_path, capsys, bundles, expected):
+    paths = []
+    for i, bundle in enumerate(bundles):
+        paths.append(tmp_path / f"bundle-{i}.yaml")
+        paths[-1].write_text(bundle)
+    argv = ["--format", "json", "--jobs", "1", "--reject-ipam-conflicts"]
+    assert validation.main(argv + [str(p) for p in paths]) == expected
+    result = json.loads(capsys.readouterr().out)
+    assert result["valid"] is (expected == 0)
+    assert [r["source"] for r in result["reports"]] == [str(p) for p in paths]
+    assert result["failures"] == {}
+
+
+def test_main_empty_documents(tmp_path, capsys):
+    bundle = tmp_path / "bundle.yaml"
+    bundle.write_text("---\n" + _bundle(2) + "---\n---\n")
+    assert validation.main([str(bundle)]) == 0
+    assert f"{bundle}: 2 documents, valid" in capsys.readouterr().out
+
+
+def test_main_unreadable(tmp_path, capsys):
+    missing = tmp_path / "missing.yaml"
+    invalid = tmp_path / "invalid.yaml"
+    invalid.write_text("{NOT,A,\tYAML}")
+    assert validation.main([str(missing), str(invalid)]) == 2
+    out = capsys.readouterr().out
+    assert f"{missing}: " in out
+    assert f"{invalid}: " in out